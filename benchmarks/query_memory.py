@@ -0,0 +1,61 @@
+"""
+    benchmarks.query_memory
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures how many bytes a typical built (and lexed) query keeps alive.
+
+    Usage: python benchmarks/query_memory.py [queries_count]
+"""
+
+from __future__ import print_function, unicode_literals
+
+import gc
+import os
+import sys
+import tracemalloc
+
+# Runs from the source tree without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sphinxit.core.helpers import BaseSearchConfig
+from sphinxit.core.nodes import Count, OR
+from sphinxit.core.processor import Search
+
+
+class BenchConfig(BaseSearchConfig):
+    WITH_STATUS = False
+
+
+def build_query(connector):
+    search = (
+        Search(indexes=['company'], config=BenchConfig, connector=connector)
+        .select('id', 'name', Count())
+        .match('Yandex')
+        .filter(id__gte=100, date_created__lte=1370000000)
+        .filter(OR(id__eq=1, rank__gt=10))
+        .group_by('date_created')
+        .order_by('name', 'desc')
+        .limit(0, 20)
+        .options(ranker='bm25', max_matches=1000)
+    )
+    search.lex()
+    return search
+
+
+def main(queries_count=1000):
+    connector = build_query(None).connector
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    queries = [build_query(connector) for _ in range(queries_count)]
+    gc.collect()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('queries built: %s' % len(queries))
+    print('bytes per built query: %.0f' % ((after - before) / float(queries_count)))
+    print('peak bytes per built query: %.0f' % ((peak - before) / float(queries_count)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -10,21 +10,46 @@
 
 from __future__ import unicode_literals
 
+import re
+import sys
 import threading
 from collections import deque
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+import six
+
+from .helpers import LRUCache
 from .mixins import ConfigMixin
-from .exceptions import ImproperlyConfigured, SphinxQLDriverException
+from .exceptions import (
+    ImproperlyConfigured,
+    SphinxQLConnectionException,
+    SphinxQLDriverException,
+)
 
 
 class SphinxConnector(ConfigMixin):
-
-    def __init__(self, config):
+    # The pages of the same query have the same META, except the time.
+    # Only the LIMIT of the query itself is removed, the quoted strings
+    # and the FACET clauses with their own LIMIT are kept.
+    _limit_re = re.compile(
+        r"^(?P<head>(?:'(?:[^'\\]|\\.)*'|(?! FACET )[^'])*?) LIMIT \d+,\s*\d+"
+    )
+    _meta_cache_size = 1024
+    # DB-API errors of the lost or broken connection
+    _connection_errors = ('OperationalError', 'InterfaceError')
+
+    def __init__(self, config, searchd_connection=None):
         connection_options = {
             'host': '127.0.0.1',
             'port': 9306,
         }
         connection_options.update(config.SEARCHD_CONNECTION)
+        # Overrides the config connection, to connect to the specific node
+        connection_options.update(searchd_connection or {})
 
         self.config = config
         self.connection_options = connection_options
@@ -51,6 +76,10 @@ class SphinxConnector(ConfigMixin):
         self.__connections_pool = deque([])
         self.__local = threading.local()
         self.__conn_lock = threading.Lock()
+        self.__meta_cache = LRUCache(
+            max_size=self._meta_cache_size,
+            ttl=getattr(config, 'META_CACHE_TTL', 0),
+        )
 
     def __del__(self):
         self.close_connections()
@@ -67,21 +96,23 @@ class SphinxConnector(ConfigMixin):
             raise ImproperlyConfigured(
                 'Oursql or MySQLdb library has to be installed to work with searchd'
             )
-        if not self.__connections_pool:
-            for i in range(getattr(self.config, 'POOL_SIZE', 10)):
-                if self.oursql:
-                    self.__connections_pool.append(self.sql_client.connect(
-                        **self.connection_options
-                    ))
-                if self.mysqldb:
-                    self.__connections_pool.append(self.sql_client.connect(
-                        cursorclass=self.sql_client.cursors.DictCursor,
-                        use_unicode=self.connection_options.pop('use_unicode', True),
-                        charset=self.connection_options.pop('charset', 'utf8'),
-                        **self.connection_options
-                    ))
-
+        # The pool is filled once for all of the threads
         with self.__conn_lock:
+            if not self.__connections_pool:
+                for i in range(getattr(self.config, 'POOL_SIZE', 10)):
+                    if self.oursql:
+                        self.__connections_pool.append(self.sql_client.connect(
+                            **self.connection_options
+                        ))
+                    if self.mysqldb:
+                        # The options are kept for the reconnects
+                        connection_options = dict(self.connection_options)
+                        self.__connections_pool.append(self.sql_client.connect(
+                            cursorclass=self.sql_client.cursors.DictCursor,
+                            use_unicode=connection_options.pop('use_unicode', True),
+                            charset=connection_options.pop('charset', 'utf8'),
+                            **connection_options
+                        ))
             self.__local.conn = self.__connections_pool.pop()
 
         return self.__local.conn
@@ -108,23 +139,55 @@ class SphinxConnector(ConfigMixin):
     def _normalize_status(self, raw_result):
         return dict([(x['Counter'], x['Value']) for x in raw_result])
 
-    def _execute_batch(self, cursor, sxql_batch):
+    def get_meta_fingerprint(self, sxql_query):
+        return self._limit_re.sub(r'\g<head>', sxql_query, count=1)
+
+    def get_cached_meta(self, sxql_query):
+        # META is cached by the query without LIMIT for META_CACHE_TTL seconds
+        if not self.__meta_cache.ttl:
+            return None
+
+        meta = self.__meta_cache.get(self.get_meta_fingerprint(sxql_query))
+        return dict(meta) if meta is not None else None
+
+    def set_cached_meta(self, sxql_query, meta):
+        if not self.__meta_cache.ttl:
+            return
+        self.__meta_cache.set(self.get_meta_fingerprint(sxql_query), dict(meta))
+
+    def _execute_batch(self, cursor, sxql_batch, with_meta=None, with_status=None):
         total_results = {}
+        if with_meta is None:
+            with_meta = getattr(self.config, 'WITH_META', False)
+        if with_status is None:
+            with_status = getattr(self.config, 'WITH_STATUS', False)
 
         cursor_exec = self._get_cursor_exec(cursor)
 
         for sub_ql_pair in sxql_batch:
             subresult = {}
-            sub_ql, sub_alias = sub_ql_pair
+            # The faceted query comes with its facet names, every
+            # facet is the next result set of the query.
+            sub_ql, sub_alias = sub_ql_pair[:2]
+            facet_names = sub_ql_pair[2] if len(sub_ql_pair) > 2 else ()
             cursor_exec(sub_ql)
             subresult['items'] = [r for r in cursor]
+            if facet_names:
+                subresult['facets'] = OrderedDict()
+                for facet_name in facet_names:
+                    cursor.nextset()
+                    subresult['facets'][facet_name] = [r for r in cursor]
 
-            if getattr(self.config, 'WITH_META', False):
+            if with_meta:
                 meta_ql, meta_alias = 'SHOW META', 'meta'
-                cursor_exec(meta_ql)
-                subresult[meta_alias] = self._normalize_meta(cursor)
-
-            if getattr(self.config, 'WITH_STATUS', False):
+                meta = self.get_cached_meta(sub_ql)
+                if meta is None:
+                    cursor_exec(meta_ql)
+                    meta = self._normalize_meta(cursor)
+                    self.set_cached_meta(sub_ql, meta)
+                subresult[meta_alias] = meta
+
+            if with_status:
                 status_ql, status_alias = 'SHOW STATUS', 'status'
                 cursor_exec(status_ql)
                 subresult[status_alias] = self._normalize_status(cursor)
@@ -139,16 +202,52 @@ class SphinxConnector(ConfigMixin):
 
         return cursor.fetchall()
 
-    def execute(self, sxql_query):
-        connection = self.get_connection()
-        cursor = self.get_cursor(connection)
+    def _execute_writes(self, cursor, sxql_queries, transaction=False):
+        cursor_exec = self._get_cursor_exec(cursor)
+        affected_rows = 0
+        if transaction:
+            cursor_exec('BEGIN')
+        try:
+            for sxql_query in sxql_queries:
+                cursor_exec(sxql_query)
+                affected_rows += max(cursor.rowcount, 0)
+            if transaction:
+                cursor_exec('COMMIT')
+        except Exception:
+            exc_info = sys.exc_info()
+            if transaction:
+                try:
+                    cursor_exec('ROLLBACK')
+                except Exception:
+                    pass
+            six.reraise(*exc_info)
+
+        return affected_rows
+
+    def _close_connection(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _process(self, executor, sxql):
+        # Connection errors are raised as SphinxQLConnectionException, the
+        # broken connection is closed instead of returning it to the pool,
+        # the next query reconnects.
+        connection = None
+        cursor = None
         total_results = {}
+        is_alive = True
         try:
-            if isinstance(sxql_query, (tuple, list)):
-                total_results = self._execute_batch(cursor, sxql_query)
-            else:
-                total_results = self._execute_query(cursor, sxql_query)
+            connection = self.get_connection()
+            cursor = self.get_cursor(connection)
+            total_results = executor(cursor, sxql)
+        except ImproperlyConfigured:
+            raise
         except Exception as e:
+            is_alive = type(e).__name__ not in self._connection_errors
+            if not is_alive:
+                raise SphinxQLConnectionException(e)
             if self.oursql and type(e).__name__ == 'ProgrammingError':
                 errno, msg, extra = e
                 if errno is not None:
@@ -156,7 +255,35 @@ class SphinxConnector(ConfigMixin):
             else:
                 raise SphinxQLDriverException(e)
         finally:
-            cursor.close()
-            self.__connections_pool.appendleft(connection)
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except Exception:
+                    is_alive = False
+            if connection is not None:
+                if is_alive:
+                    self.__connections_pool.appendleft(connection)
+                else:
+                    self._close_connection(connection)
 
         return total_results
+
+    def execute(self, sxql_query, with_meta=None, with_status=None):
+        # with_meta and with_status override the config for the batch
+        if isinstance(sxql_query, (tuple, list)):
+            return self._process(
+                lambda cursor, batch: self._execute_batch(
+                    cursor, batch, with_meta, with_status
+                ),
+                sxql_query,
+            )
+        return self._process(self._execute_query, sxql_query)
+
+    def execute_writes(self, sxql_queries, transaction=False):
+        # Executes the batch of UPDATE-like queries one by one with the same
+        # connection (within BEGIN/COMMIT if transaction is True), returns
+        # the total number of affected rows.
+        return self._process(
+            lambda cursor, queries: self._execute_writes(cursor, queries, transaction),
+            sxql_queries,
+        ) or 0
@@ -70,7 +70,7 @@ ESCAPED_CHARS = namedtuple('EscapedChars', ['single_escape', 'double_escape'])(
     double_escape=('@', '!', '^', '(', ')', '~', '-', '|', '/', '<<', '$', '"')
 )
 
-NODES_ORDER = namedtuple('NodesOrder', ['select', 'update'])(
+NODES_ORDER = namedtuple('NodesOrder', ['select', 'update', 'delete'])(
     select=(
         'SelectFrom',
         'Where',
@@ -78,11 +78,16 @@ NODES_ORDER = namedtuple('NodesOrder', ['select', 'update'])(
         'OrderBy',
         'WithinGroupOrderBy',
         'Limit',
-        'Options'
+        'Options',
+        'Facets'
     ),
     update=(
         'UpdateSet',
         'Where',
         'Options'
+    ),
+    delete=(
+        'DeleteFrom',
+        'Where'
     )
 )
@@ -11,30 +11,75 @@
 from __future__ import unicode_literals
 
 import re
+
 import six
 from datetime import datetime, date
 
-from sphinxit.core.constants import ESCAPED_CHARS, RESERVED_KEYWORDS
+from sphinxit.core.constants import RESERVED_KEYWORDS
 from sphinxit.core.exceptions import SphinxQLSyntaxException
 from sphinxit.core.helpers import (
+    get_query_escaper,
+    is_sequence,
     list_of_integers_only,
     int_from_digit,
+    quote_string,
     unix_timestamp
 )
 from sphinxit.core.mixins import CtxMixin
 
 
+RESERVED_KEYWORDS_SET = frozenset(RESERVED_KEYWORDS)
+
+# Identifiers which have already passed the validation. It's bounded
+# to not grow forever with arbitrary user supplied field names.
+CHECKED_IDENTIFIERS_LIMIT = 4096
+_checked_identifiers = set()
+
+
+# Only plain names are remembered, not the expressions with user values
+_identifier_re = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def remember_identifiers(*identifiers):
+    identifiers = [i for i in identifiers if _identifier_re.match(i)]
+    if not identifiers:
+        return
+    if len(_checked_identifiers) >= CHECKED_IDENTIFIERS_LIMIT:
+        _checked_identifiers.clear()
+    _checked_identifiers.update(identifiers)
+
+
+# Parsed "attr__operator" filter keys. Keys mostly come from the code,
+# so the set is small, but it's bounded anyway.
+PARSED_FILTER_KEYS_LIMIT = 4096
+_parsed_filter_keys = {}
+
+
+def parse_filter_key(k_attr):
+    parsed = _parsed_filter_keys.get(k_attr)
+    if parsed is None:
+        parsed = tuple(k_attr.rsplit('__', 1))
+        if len(parsed) != 2:
+            parsed = (k_attr, None)
+        if len(_parsed_filter_keys) >= PARSED_FILTER_KEYS_LIMIT:
+            _parsed_filter_keys.clear()
+        _parsed_filter_keys[k_attr] = parsed
+    return parsed
+
+
 class FilterCtx(CtxMixin):
+    __slots__ = ('k_attr', 'v_attr')
     _allowed_conditions_map = {
-        '__eq': '{a}={v}',
-        '__neq': '{a}!={v}',
-        '__gt': '{a}>{v}',
-        '__gte': '{a}>={v}',
-        '__lt': '{a}<{v}',
-        '__lte': '{a}<={v}',
-        '__in': '{a} IN ({v})',
-        '__between': '{a} BETWEEN {f_v} AND {s_v}',
+        'eq': lambda a, v: '%s=%s' % (a, v),
+        'neq': lambda a, v: '%s!=%s' % (a, v),
+        'gt': lambda a, v: '%s>%s' % (a, v),
+        'gte': lambda a, v: '%s>=%s' % (a, v),
+        'lt': lambda a, v: '%s<%s' % (a, v),
+        'lte': lambda a, v: '%s<=%s' % (a, v),
+        'in': lambda a, v: '%s IN (%s)' % (a, ','.join(map(str, v))),
+        'between': lambda a, v: '%s BETWEEN %s AND %s' % (a, v[0], v[1]),
     }
+    _sequence_conditions = ('in', 'between')
 
     def __init__(self, k_attr, v_attr):
         super(FilterCtx, self).__init__()
@@ -48,7 +93,7 @@ class FilterCtx(CtxMixin):
                 v_attr,
                 is_strict=self.is_strict
             )
-        if isinstance(self.v_attr, (tuple, list)):
+        if is_sequence(self.v_attr):
             v_attr = list_of_integers_only(
                 v_attr,
                 is_strict=self.is_strict
@@ -59,79 +104,57 @@ class FilterCtx(CtxMixin):
         if not v_attr and v_attr != 0:
             return None
 
-        for ending in self._allowed_conditions_map.keys():
-            if not self.k_attr.endswith(ending):
-                continue
-
-            if (
-                ending not in ('__between', '__in')
-                and isinstance(v_attr, (tuple, list))
-                and not self.__exit__(
-                    exc_val=SphinxQLSyntaxException(
-                        '%s found but not allowed for %s condition' %
-                        (self.v_attr, self.k_attr)
-                    )
+        if isinstance(self.k_attr, six.string_types):
+            a, condition = parse_filter_key(self.k_attr)
+            condition_lex = self._allowed_conditions_map.get(condition)
+        else:
+            condition_lex = None
+        if condition_lex is None:
+            return self.__exit__(
+                exc_val=SphinxQLSyntaxException(
+                    '%s is invalid condition' % self.k_attr
                 )
-            ):
-                continue
+            )
 
-            if (
-                ending in ('__between', '__in')
-                and not isinstance(v_attr, (tuple, list))
-                and not self.__exit__(
-                    exc_val=SphinxQLSyntaxException(
-                        '%s condition found but the type of %s is not list or tuple' %
-                        (self.k_attr, self.v_attr)
-                    )
+        has_sequence = isinstance(v_attr, (tuple, list))
+        if condition not in self._sequence_conditions and has_sequence:
+            return self.__exit__(
+                exc_val=SphinxQLSyntaxException(
+                    '%s found but not allowed for %s condition' %
+                    (self.v_attr, self.k_attr)
                 )
-            ):
-                continue
-
-            a = self.k_attr[:self.k_attr.rindex(ending)]
-            v = v_attr
-
-            if ending == '__between':
-                if (
-                    (len(v_attr) != 2 or len(v_attr) != len(self.v_attr))
-                    and not self.__exit__(
-                        exc_val=SphinxQLSyntaxException(
-                            '%s condition wants a pair value and %s is not' %
-                            (self.k_attr, self.v_attr)
-                        )
-                    )
-                ):
-                    continue
-
-                f_v, s_v = v_attr
-                return self._allowed_conditions_map[ending].format(
-                    a=a,
-                    f_v=f_v,
-                    s_v=s_v
+            )
+        if condition in self._sequence_conditions and not has_sequence:
+            return self.__exit__(
+                exc_val=SphinxQLSyntaxException(
+                    '%s condition found but the type of %s is not list or tuple' %
+                    (self.k_attr, self.v_attr)
                 )
-
-            if ending == '__in':
-                v = ','.join([str(v) for v in v_attr])
-
-            return self._allowed_conditions_map[ending].format(a=a, v=v)
-
-        return self.__exit__(
-            exc_val=SphinxQLSyntaxException(
-                '%s is invalid condition' % self.k_attr
             )
-        )
+        if (
+            condition == 'between'
+            and (len(v_attr) != 2 or len(v_attr) != len(self.v_attr))
+        ):
+            return self.__exit__(
+                exc_val=SphinxQLSyntaxException(
+                    '%s condition wants a pair value and %s is not' %
+                    (self.k_attr, self.v_attr)
+                )
+            )
+
+        return condition_lex(a, v_attr)
 
 
 class ORFilterCtx(FilterCtx):
-    _allowed_conditions_map = {
-        '__eq': '{a}={v}',
-        '__gt': '{a}>{v}',
-        '__gte': '{a}>={v}',
-        '__lt': '{a}<{v}',
-        '__lte': '{a}<={v}',
-    }
+    __slots__ = ()
+    _allowed_conditions_map = dict([
+        (condition, FilterCtx._allowed_conditions_map[condition])
+        for condition in ('eq', 'gt', 'gte', 'lt', 'lte')
+    ])
 
 
 class MatchQueryCtx(CtxMixin):
+    __slots__ = ('query', 'is_raw')
 
     def __init__(self, query, raw=False):
         super(MatchQueryCtx, self).__init__()
@@ -149,36 +172,32 @@ class MatchQueryCtx(CtxMixin):
             return None
 
         if not self.is_raw:
-            single_escape_chars_re = '|\\'.join(ESCAPED_CHARS.single_escape)
-            self.query = re.sub(
-                single_escape_chars_re,
-                lambda m: r'\%s' % m.group(),
-                self.query
-            )
-            double_escape_chars_re = '|\\'.join(ESCAPED_CHARS.double_escape)
-            self.query = re.sub(
-                double_escape_chars_re,
-                lambda m: r'\\%s' % m.group(),
-                self.query
-            )
+            self.query = get_query_escaper(
+                getattr(self.config, 'MATCH_ESCAPE_CACHE_SIZE', 0)
+            ).escape(self.query)
 
         return self.query
 
 
 class FieldCtx(CtxMixin):
+    __slots__ = ('field',)
 
     def __init__(self, field):
         super(FieldCtx, self).__init__()
         self.field = field
 
     def __enter__(self):
+        if self.is_trusted:
+            return self.field
         if not isinstance(self.field, six.string_types):
             return self.__exit__(
                 exc_val=SphinxQLSyntaxException(
                     '"%s" is not a string' % self.field
                 )
             )
-        if self.field.upper() in RESERVED_KEYWORDS:
+        if self.field in _checked_identifiers:
+            return self.field
+        if self.field.upper() in RESERVED_KEYWORDS_SET:
             return self.__exit__(
                 exc_val=SphinxQLSyntaxException(
                     '"%s" is reserved keyword for Sphinx' % self.field
@@ -189,10 +208,12 @@ class FieldCtx(CtxMixin):
                 exc_val=SphinxQLSyntaxException('The field is empty')
             )
 
+        remember_identifiers(self.field)
         return self.field
 
 
 class AliasFieldCtx(CtxMixin):
+    __slots__ = ('field', 'alias', 'called_cls')
 
     def __init__(self, field, alias):
         super(AliasFieldCtx, self).__init__()
@@ -205,6 +226,9 @@ class AliasFieldCtx(CtxMixin):
         return self
 
     def __enter__(self):
+        if self.is_trusted:
+            return '%s AS %s' % (self.field, self.alias)
+
         error_prefix = (
             'Trouble with %s. ' % self.called_cls.__name__
             if self.called_cls else ''
@@ -221,13 +245,18 @@ class AliasFieldCtx(CtxMixin):
                     '"%s" alias is not a string' % self.field
                 )
             )
-        if self.alias.upper() in RESERVED_KEYWORDS:
+        if (
+            self.field in _checked_identifiers
+            and self.alias in _checked_identifiers
+        ):
+            return '%s AS %s' % (self.field, self.alias)
+        if self.alias.upper() in RESERVED_KEYWORDS_SET:
             return self.__exit__(
                 exc_val=SphinxQLSyntaxException(
                     '"%s" is reserved keyword for Sphinx' % self.alias
                 )
             )
-        if self.field.upper() in RESERVED_KEYWORDS:
+        if self.field.upper() in RESERVED_KEYWORDS_SET:
             return self.__exit__(
                 exc_val=SphinxQLSyntaxException(
                     '"%s" is reserved keyword for Sphinx' % self.field
@@ -242,10 +271,12 @@ class AliasFieldCtx(CtxMixin):
                 exc_val=SphinxQLSyntaxException('The alias is empty')
             )
 
+        remember_identifiers(self.field, self.alias)
         return '%s AS %s' % (self.field, self.alias)
 
 
 class OrderCtx(CtxMixin):
+    __slots__ = ('field', 'direction')
 
     def __init__(self, field, direction):
         super(OrderCtx, self).__init__()
@@ -253,13 +284,30 @@ class OrderCtx(CtxMixin):
         self.direction = direction
 
     def __enter__(self):
+        if not self.is_trusted and not self.is_checked_field():
+            return None
+        if (
+            not isinstance(self.direction, six.string_types)
+            or self.direction.upper() not in ('ASC', 'DESC')
+        ):
+            return self.__exit__(
+                exc_val=SphinxQLSyntaxException(
+                    'Order direction can be ASC or DESC, "%s" is not' % self.direction
+                )
+            )
+
+        return '%s %s' % (self.field, self.direction.upper())
+
+    def is_checked_field(self):
         if not isinstance(self.field, six.string_types):
             return self.__exit__(
                 exc_val=SphinxQLSyntaxException(
                     '"%s" field is not a string' % self.field
                 )
             )
-        if self.field.upper() in RESERVED_KEYWORDS:
+        if self.field in _checked_identifiers:
+            return True
+        if self.field.upper() in RESERVED_KEYWORDS_SET:
             return self.__exit__(
                 exc_val=SphinxQLSyntaxException(
                     '"%s" field is reserved keyword in Sphinx '
@@ -270,20 +318,13 @@ class OrderCtx(CtxMixin):
             return self.__exit__(
                 exc_val=SphinxQLSyntaxException('The field is empty')
             )
-        if (
-            not isinstance(self.direction, six.string_types)
-            or self.direction.upper() not in ('ASC', 'DESC')
-        ):
-            return self.__exit__(
-                exc_val=SphinxQLSyntaxException(
-                    'Order direction can be ASC or DESC, "%s" is not' % self.direction
-                )
-            )
 
-        return '%s %s' % (self.field, self.direction.upper())
+        remember_identifiers(self.field)
+        return True
 
 
 class LimitCtx(CtxMixin):
+    __slots__ = ('offset', 'limit')
 
     def __init__(self, offset, limit):
         super(LimitCtx, self).__init__()
@@ -320,6 +361,7 @@ class LimitCtx(CtxMixin):
 
 
 class OptionsCtx(CtxMixin):
+    __slots__ = ('option', 'params')
 
     def __init__(self, option, params):
         super(OptionsCtx, self).__init__()
@@ -496,6 +538,7 @@ class OptionsCtx(CtxMixin):
 
 
 class UpdateSetCtx(CtxMixin):
+    __slots__ = ('k_attr', 'v_attr')
 
     def __init__(self, k_attr, v_attr):
         super(UpdateSetCtx, self).__init__()
@@ -546,7 +589,37 @@ class UpdateSetCtx(CtxMixin):
         return '%s=%s' % (self.k_attr, v_attr)
 
 
+class InsertValueCtx(CtxMixin):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        super(InsertValueCtx, self).__init__()
+        self.value = value
+
+    def __enter__(self):
+        if isinstance(self.value, bool):
+            return '1' if self.value else '0'
+        if isinstance(self.value, (six.integer_types, float)):
+            return str(self.value)
+        if isinstance(self.value, six.string_types):
+            return "'%s'" % quote_string(self.value)
+        if isinstance(self.value, (datetime, date)):
+            return unix_timestamp(self.value)
+        if is_sequence(self.value):
+            return '(%s)' % ','.join(map(str, list_of_integers_only(
+                self.value,
+                is_strict=self.is_strict,
+            )))
+
+        return self.__exit__(
+            exc_val=SphinxQLSyntaxException(
+                '%s is improper value for INSERT clause' % (self.value,)
+            )
+        )
+
+
 class SnippetsOptionsCtx(CtxMixin):
+    __slots__ = ('option', 'params')
 
     def __init__(self, option, params):
         super(SnippetsOptionsCtx, self).__init__()
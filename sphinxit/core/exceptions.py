@@ -13,6 +13,12 @@ class SphinxQLDriverException(Exception):
     pass
 
 
+class SphinxQLConnectionException(SphinxQLDriverException):
+    # searchd is unreachable or the connection is lost,
+    # the same query can succeed later.
+    pass
+
+
 class SphinxQLSyntaxException(Exception):
     pass
 
@@ -0,0 +1,188 @@
+"""
+    sphinxit.core.exporters
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Implements parallel export of the search results.
+
+    :copyright: (c) 2013 by Roman Semirook.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import threading
+import time
+
+import six
+
+from sphinxit.core.exceptions import ImproperlyConfigured, SphinxQLDriverException
+from sphinxit.core.mixins import ConfigMixin
+from sphinxit.core.nodes import Min, Max
+
+
+class JSONLinesWriter(object):
+    __slots__ = ('_file',)
+
+    def __init__(self, path):
+        self._file = io.open(path, 'w', encoding='utf-8')
+
+    def write(self, row):
+        self._file.write(
+            six.text_type(json.dumps(row, default=six.text_type)) + '\n'
+        )
+
+    def close(self):
+        self._file.close()
+
+
+class CSVWriter(object):
+    __slots__ = ('_file', '_writer', '_fields')
+
+    def __init__(self, path):
+        if six.PY2:
+            self._file = open(path, 'wb')
+        else:
+            self._file = io.open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        self._fields = None
+
+    def _write_row(self, values):
+        if six.PY2:
+            values = [six.text_type(v).encode('utf-8') for v in values]
+        self._writer.writerow(values)
+
+    def write(self, row):
+        # The header is taken from the first row
+        if self._fields is None:
+            self._fields = list(row.keys())
+            self._write_row(self._fields)
+        self._write_row([row.get(field, '') for field in self._fields])
+
+    def close(self):
+        self._file.close()
+
+
+class RangeExporter(ConfigMixin):
+    __slots__ = (
+        'search',
+        'partitions_count',
+        'batch_size',
+        'progress',
+        'partitions',
+        'errors',
+        '_lock',
+    )
+
+    _formats = {
+        'jsonl': JSONLinesWriter,
+        'csv': CSVWriter,
+    }
+
+    def __init__(self, search, partitions_count=None, batch_size=1000, progress=None):
+        super(RangeExporter, self).__init__()
+        self.search = search
+        self.config = search.config
+        self.partitions_count = (
+            partitions_count or getattr(self.config, 'POOL_SIZE', 5)
+        )
+        self.batch_size = batch_size
+        self.progress = progress
+        self.partitions = []
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def get_id_range(self):
+        alias = getattr(self.search, '_name', 'result')
+        result = (
+            self.search
+            .select(Min('id', 'min_id'), Max('id', 'max_id'))
+            .limit(0, 1)
+            .ask(alias=alias)
+        )
+        items = result[alias]['items']
+        if not items or items[0]['min_id'] is None:
+            return None
+        return int(items[0]['min_id']), int(items[0]['max_id'])
+
+    def get_ranges(self):
+        id_range = self.get_id_range()
+        if id_range is None:
+            return []
+
+        min_id, max_id = id_range
+        step = (max_id - min_id) // self.partitions_count + 1
+        return [
+            (start, min(start + step - 1, max_id))
+            for start in range(min_id, max_id + 1, step)
+        ]
+
+    def _export_partition(self, partition, path, rows_writer_cls):
+        rows_writer = rows_writer_cls(path)
+        try:
+            rows = (
+                self.search
+                .filter(id__between=partition['range'])
+                .scan(batch_size=self.batch_size)
+            )
+            for row in rows:
+                rows_writer.write(row)
+                partition['rows_written'] += 1
+                if partition['rows_written'] % self.batch_size == 0:
+                    self._report(partition)
+        except Exception as e:
+            with self._lock:
+                self.errors.append(e)
+        finally:
+            rows_writer.close()
+            partition['finished_at'] = time.time()
+            self._report(partition)
+
+    def _report(self, partition):
+        if self.progress is not None:
+            with self._lock:
+                self.progress(dict(partition))
+
+    def export(self, path_template, format='jsonl'):
+        # Every id range is scanned by its own thread into its own file,
+        # path_template is formatted with the partition number.
+        if format not in self._formats:
+            raise ImproperlyConfigured(
+                '%s is unknown export format. Valid values are %s' %
+                (format, ', '.join(sorted(self._formats)))
+            )
+
+        self.errors = []
+        self.partitions = [
+            {
+                'partition': number,
+                'range': id_range,
+                'path': path_template.format(partition=number),
+                'rows_written': 0,
+                'started_at': time.time(),
+                'finished_at': None,
+            }
+            for number, id_range in enumerate(self.get_ranges())
+        ]
+        workers = [
+            threading.Thread(
+                target=self._export_partition,
+                args=(partition, partition['path'], self._formats[format]),
+            )
+            for partition in self.partitions
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if self.errors:
+            raise SphinxQLDriverException(
+                '%s partitions were not exported, the last error: %s' %
+                (len(self.errors), self.errors[-1])
+            )
+
+        return self.partitions
@@ -10,9 +10,19 @@
 
 from __future__ import unicode_literals
 
+import re
+import threading
 import time
+from array import array
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
 import six
 
+from sphinxit.core.constants import ESCAPED_CHARS
 from sphinxit.core.exceptions import SphinxQLSyntaxException
 
 
@@ -35,7 +45,32 @@ def string_from_string(value, is_strict=False):
     return value
 
 
+INTEGER_TYPECODES = frozenset('bBhHiIlLqQ')
+
+
+def is_numpy_integers(value):
+    # NumPy is optional, so arrays are recognized without importing it
+    dtype = getattr(value, 'dtype', None)
+    return getattr(dtype, 'kind', None) in ('i', 'u') and hasattr(value, 'tolist')
+
+
+def is_sequence(value):
+    return (
+        isinstance(value, (tuple, list, array, six.moves.range))
+        or is_numpy_integers(value)
+    )
+
+
 def list_of_integers_only(sequence, is_strict=False):
+    if isinstance(sequence, array) and sequence.typecode in INTEGER_TYPECODES:
+        return sequence.tolist()
+    if isinstance(sequence, six.moves.range):
+        return list(sequence)
+    if is_numpy_integers(sequence):
+        return sequence.ravel().tolist()
+    if set(map(type, sequence)).issubset(six.integer_types):
+        return list(sequence)
+
     cleaned_sequence = []
     for orig_value in sequence:
         clean_value = int_from_digit(orig_value, is_strict)
@@ -63,15 +98,99 @@ def sparse_free_sequence(sequence):
     ]
 
 
+def quote_string(value):
+    # Escapes the value to be placed into single quoted SphinxQL string
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+
 def unix_timestamp(datetime):
     return str(int(time.mktime(datetime.timetuple())))
 
 
+class QueryEscaper(object):
+    # Escapes all of the special characters in a single pass with the
+    # precompiled pattern, results are cached if `cache_size` is set.
+    __slots__ = ('cache_size', '_cache')
+
+    _escapes = dict(
+        [(c, '\\' + c) for c in ESCAPED_CHARS.single_escape]
+        + [(c, '\\\\' + c) for c in ESCAPED_CHARS.double_escape]
+    )
+    _escapes_re = re.compile('|'.join([
+        re.escape(c) for c in sorted(_escapes, key=len, reverse=True)
+    ]))
+
+    def __init__(self, cache_size=0):
+        self.cache_size = cache_size
+        self._cache = {}
+
+    def _replace(self, match):
+        return self._escapes[match.group()]
+
+    def escape(self, query):
+        if not self.cache_size:
+            return self._escapes_re.sub(self._replace, query)
+
+        escaped = self._cache.get(query)
+        if escaped is None:
+            escaped = self._escapes_re.sub(self._replace, query)
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[query] = escaped
+        return escaped
+
+
+_query_escapers = {}
+
+
+def get_query_escaper(cache_size=0):
+    escaper = _query_escapers.get(cache_size)
+    if escaper is None:
+        escaper = _query_escapers.setdefault(cache_size, QueryEscaper(cache_size))
+    return escaper
+
+
+class LRUCache(object):
+    # Thread safe LRU cache with optional TTL in seconds
+    __slots__ = ('max_size', 'ttl', '_items', '_lock')
+
+    def __init__(self, max_size=10, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            cached = self._items.pop(key, None)
+            if cached is None:
+                return None
+            value, cached_at = cached
+            if self.ttl is not None and time.time() - cached_at > self.ttl:
+                return None
+            self._items[key] = cached
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, time.time())
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
 class BaseSearchConfig(object):
     DEBUG = True
     WITH_META = True
     WITH_STATUS = True
     POOL_SIZE = 5
+    TRUSTED_IDENTIFIERS = False
+    MAX_QUERY_SIZE = 0
+    MATCH_ESCAPE_CACHE_SIZE = 0
+    META_CACHE_TTL = 0
     SQL_ENGINE = 'oursql'
     SEARCHD_CONNECTION = {
         'host': '127.0.0.1',
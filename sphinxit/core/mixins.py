@@ -10,10 +10,14 @@
 
 from __future__ import unicode_literals
 
+from copy import copy
+from functools import wraps
+
 from .exceptions import ImproperlyConfigured
 
 
 class MagicMixin(object):
+    __slots__ = ()
 
     def __bool__(self):
         return True
@@ -29,6 +33,7 @@ class MagicMixin(object):
 
 
 class ConfigMixin(MagicMixin):
+    __slots__ = ('_config',)
 
     def __init__(self):
         self._config = None
@@ -58,8 +63,55 @@ class ConfigMixin(MagicMixin):
 
 
 class CtxMixin(ConfigMixin):
+    __slots__ = ('_is_trusted',)
+
+    def __init__(self):
+        super(CtxMixin, self).__init__()
+        self._is_trusted = None
+
+    def trusted(self, is_trusted=True):
+        if is_trusted is not None:
+            self._is_trusted = is_trusted
+        return self
+
+    @property
+    def is_trusted(self):
+        if self._is_trusted is not None:
+            return self._is_trusted
+        return getattr(self.config, 'TRUSTED_IDENTIFIERS', False)
 
     def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
         if exc_val is not None and self.is_strict:
             raise exc_val
         return None
+
+
+class CopyMixin(object):
+    __slots__ = ()
+    # Mutable containers which have to be duplicated to make the copy
+    # independent, everything else is shared with the original.
+    _copy_attrs = ()
+
+    def copy(self):
+        new_inst = copy(self)
+        for attr in self._copy_attrs:
+            setattr(new_inst, attr, copy(getattr(self, attr)))
+        return new_inst
+
+
+class LexCacheMixin(ConfigMixin):
+    __slots__ = ('_lex_cache',)
+
+    def __init__(self):
+        super(LexCacheMixin, self).__init__()
+        self._lex_cache = None
+
+
+def cached_lex(lex):
+    @wraps(lex)
+    def wrapper(self):
+        if self._lex_cache is None:
+            self._lex_cache = lex(self)
+        return self._lex_cache
+    return wrapper
+
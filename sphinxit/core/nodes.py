@@ -10,7 +10,11 @@
 
 from __future__ import unicode_literals
 
+import re
 from collections import deque
+from functools import reduce
+
+import six
 
 from sphinxit.core.convertors import (
     FilterCtx,
@@ -22,17 +26,25 @@ from sphinxit.core.convertors import (
     LimitCtx,
     OptionsCtx,
     UpdateSetCtx,
+    InsertValueCtx,
     SnippetsOptionsCtx
 )
 from sphinxit.core.helpers import (
+    int_from_digit,
+    quote_string,
     sparse_free_sequence,
     string_from_string,
 )
 from sphinxit.core.exceptions import SphinxQLSyntaxException
-from sphinxit.core.mixins import ConfigMixin
+from sphinxit.core.mixins import (
+    ConfigMixin,
+    CopyMixin,
+)
 
 
-class SelectFromContainer(ConfigMixin):
+class SelectFromContainer(CopyMixin, ConfigMixin):
+    __slots__ = ('indexes', 'fields', 'or_fields')
+    _copy_attrs = ('fields', 'or_fields')
     _joiner = ', '
     _template = 'SELECT {fields} FROM {indexes}'
 
@@ -42,13 +54,13 @@ class SelectFromContainer(ConfigMixin):
         self.fields = []
         self.or_fields = []
 
-    def add_alias(self, field, alias):
-        with AliasFieldCtx(field, alias).with_config(self.config) as lex:
+    def add_alias(self, field, alias, trusted=None):
+        with AliasFieldCtx(field, alias).trusted(trusted).with_config(self.config) as lex:
             if lex and lex not in self.fields:
                 self.fields.append(lex)
 
-    def add_field(self, field):
-        with FieldCtx(field).with_config(self.config) as lex:
+    def add_field(self, field, trusted=None):
+        with FieldCtx(field).trusted(trusted).with_config(self.config) as lex:
             if lex and lex not in self.fields:
                 self.fields.append(lex)
 
@@ -72,6 +84,11 @@ class SelectFromContainer(ConfigMixin):
         if raw_lex and raw_lex not in self.fields:
             self.fields.append(raw_lex)
 
+    def minimize(self):
+        # Leaves the id and the aliased expressions only,
+        # they can be used by the filters and grouping.
+        self.fields = ['id'] + [f for f in self.fields if ' AS ' in f]
+
     def has_or_fields(self):
         return bool(self.or_fields)
 
@@ -86,10 +103,14 @@ class SelectFromContainer(ConfigMixin):
         return lex
 
 
-class FiltersContainer(ConfigMixin):
+class FiltersContainer(CopyMixin, ConfigMixin):
+    __slots__ = ('query', 'conditions')
+    _copy_attrs = ('query', 'conditions')
     _joiner = ' AND '
     _match_template = "MATCH('{query}')"
     _where_template = 'WHERE {conditions}'
+    _in_template = '{attr} IN ({values})'
+    _in_re = re.compile(r'^(?P<attr>.+) IN \((?P<values>[^()]*)\)$')
 
     def __init__(self):
         super(FiltersContainer, self).__init__()
@@ -116,6 +137,57 @@ class FiltersContainer(ConfigMixin):
         for field, value in kwargs.items():
             self.add_condition(field, value)
 
+    def split_in_condition(self, max_size, attr=None):
+        # Splits the longest IN condition (of the attr only if it's given)
+        # into the chunks to keep the lex of every container not longer
+        # than max_size bytes in UTF-8. Returns the list of containers,
+        # one per chunk.
+        matches = [
+            (len(condition.encode('utf-8')), index, self._in_re.match(condition))
+            for index, condition in enumerate(self.conditions)
+        ]
+        matches = [
+            m for m in matches
+            if m[2] is not None and attr in (None, m[2].group('attr'))
+        ]
+        if not matches:
+            return []
+
+        condition_size, index, match = max(matches, key=lambda m: m[:2])
+        max_size -= len(self.lex().encode('utf-8')) - condition_size
+        attr = match.group('attr')
+        seen_values = set()
+        values = [
+            v for v in match.group('values').split(',')
+            if not (v in seen_values or seen_values.add(v))
+        ]
+        sizes = dict([(v, len(v.encode('utf-8'))) for v in values])
+
+        empty_size = len(self._in_template.format(attr=attr, values='').encode('utf-8'))
+        if empty_size + max(sizes.values()) > max_size:
+            return []
+
+        # Every value is counted with its comma, the last one has no comma
+        chunks = [[]]
+        chunk_size = empty_size
+        for value in values:
+            if chunks[-1] and chunk_size + sizes[value] > max_size:
+                chunks.append([])
+                chunk_size = empty_size
+            chunks[-1].append(value)
+            chunk_size += sizes[value] + 1
+
+        containers = []
+        for chunk in chunks:
+            container = self.copy()
+            container.conditions[index] = self._in_template.format(
+                attr=attr,
+                values=','.join(chunk),
+            )
+            containers.append(container)
+
+        return containers
+
     def lex(self):
         query_lex = ''
         cond_lex = ''
@@ -131,29 +203,53 @@ class FiltersContainer(ConfigMixin):
         )
 
 
-class GroupByNode(ConfigMixin):
+class GroupByNode(CopyMixin, ConfigMixin):
+    __slots__ = ('field', 'per_group')
     _template = 'GROUP BY {field}'
+    _per_group_template = 'GROUP {per_group} BY {field}'
 
     def __init__(self):
         super(GroupByNode, self).__init__()
         self.field = None
+        self.per_group = None
 
     def __bool__(self):
         return bool(self.field)
 
-    def by_field(self, field):
+    def by_field(self, field, per_group=None, trusted=None):
         if not self:
-            with FieldCtx(field).with_config(self.config) as lex:
+            with FieldCtx(field).trusted(trusted).with_config(self.config) as lex:
                 if lex:
                     self.field = field
+                    self.set_per_group(per_group)
+
+    def set_per_group(self, per_group):
+        # GROUP N BY keeps up to N best rows per group instead of one
+        if per_group is None:
+            return
+        per_group = int_from_digit(per_group, is_strict=self.is_strict)
+        if per_group is not None and per_group <= 0:
+            if self.is_strict:
+                raise SphinxQLSyntaxException(
+                    'The per_group value has to be greater then 0, %s is not' % per_group
+                )
+            per_group = None
+        self.per_group = per_group
 
     def lex(self):
+        if self and self.per_group:
+            return self._per_group_template.format(
+                per_group=self.per_group,
+                field=self.field,
+            )
         if self:
             return self._template.format(field=self.field)
         return ''
 
 
-class OrderByContainer(ConfigMixin):
+class OrderByContainer(CopyMixin, ConfigMixin):
+    __slots__ = ('orderings',)
+    _copy_attrs = ('orderings',)
     _joiner = ', '
     _template = 'ORDER BY {orderings}'
 
@@ -164,8 +260,8 @@ class OrderByContainer(ConfigMixin):
     def __bool__(self):
         return bool(self.orderings)
 
-    def by_field(self, field, direction='ASC'):
-        with OrderCtx(field, direction).with_config(self.config) as lex:
+    def by_field(self, field, direction='ASC', trusted=None):
+        with OrderCtx(field, direction).trusted(trusted).with_config(self.config) as lex:
             if lex and lex not in self.orderings:
                 self.orderings.append(lex)
 
@@ -177,7 +273,8 @@ class OrderByContainer(ConfigMixin):
         return ''
 
 
-class WithinGroupOrderByNode(ConfigMixin):
+class WithinGroupOrderByNode(CopyMixin, ConfigMixin):
+    __slots__ = ('field',)
     _template = 'WITHIN GROUP ORDER BY {field}'
 
     def __init__(self):
@@ -187,9 +284,9 @@ class WithinGroupOrderByNode(ConfigMixin):
     def __bool__(self):
         return bool(self.field)
 
-    def by_field(self, field, direction='ASC'):
+    def by_field(self, field, direction='ASC', trusted=None):
         if not self:
-            with OrderCtx(field, direction).with_config(self.config) as lex:
+            with OrderCtx(field, direction).trusted(trusted).with_config(self.config) as lex:
                 if lex:
                     self.field = lex
 
@@ -199,7 +296,8 @@ class WithinGroupOrderByNode(ConfigMixin):
         return ''
 
 
-class LimitNode(ConfigMixin):
+class LimitNode(CopyMixin, ConfigMixin):
+    __slots__ = ('offset', 'limit')
     _template = 'LIMIT {offset},{limit}'
 
     def __init__(self):
@@ -224,7 +322,9 @@ class LimitNode(ConfigMixin):
         return ''
 
 
-class OptionsContainer(ConfigMixin):
+class OptionsContainer(CopyMixin, ConfigMixin):
+    __slots__ = ('options',)
+    _copy_attrs = ('options',)
     _joiner = ', '
     _template = 'OPTION {options}'
 
@@ -319,7 +419,52 @@ class OptionsContainer(ConfigMixin):
         return ''
 
 
-class UpdateSetNode(ConfigMixin):
+class FacetsContainer(CopyMixin, ConfigMixin):
+    __slots__ = ('facets', 'names')
+    _copy_attrs = ('facets', 'names')
+    _joiner = ' '
+    _template = 'FACET {field}'
+    _order_template = ' ORDER BY {ordering}'
+    _limit_template = ' LIMIT {offset},{limit}'
+
+    def __init__(self):
+        super(FacetsContainer, self).__init__()
+        self.facets = []
+        self.names = []
+
+    def __bool__(self):
+        return bool(self.facets)
+
+    def add_facet(self, field, order_by=None, ordering='DESC', limit=None, trusted=None):
+        with FieldCtx(field).trusted(trusted).with_config(self.config) as field_lex:
+            if not field_lex or field_lex in self.names:
+                return
+        facet_lex = self._template.format(field=field_lex)
+
+        if order_by is not None:
+            with OrderCtx(
+                order_by, ordering
+            ).trusted(trusted).with_config(self.config) as order_lex:
+                if not order_lex:
+                    return
+            facet_lex += self._order_template.format(ordering=order_lex)
+
+        if limit is not None:
+            with LimitCtx(0, limit).with_config(self.config) as pair:
+                if not pair:
+                    return
+            facet_lex += self._limit_template.format(offset=pair[0], limit=pair[1])
+
+        self.facets.append(facet_lex)
+        self.names.append(field_lex)
+
+    def lex(self):
+        return self._joiner.join(self.facets)
+
+
+class UpdateSetNode(CopyMixin, ConfigMixin):
+    __slots__ = ('indexes', 'set_values')
+    _copy_attrs = ('set_values',)
     _template = 'UPDATE {indexes} SET {values}'
     _joiner = ', '
 
@@ -341,7 +486,73 @@ class UpdateSetNode(ConfigMixin):
         return ''
 
 
+class DeleteFromNode(CopyMixin, ConfigMixin):
+    __slots__ = ('indexes',)
+    _template = 'DELETE FROM {indexes}'
+    _joiner = ', '
+
+    def __init__(self, indexes=None):
+        super(DeleteFromNode, self).__init__()
+        self.indexes = indexes
+
+    def __bool__(self):
+        return bool(self.indexes)
+
+    def lex(self):
+        return self._template.format(indexes=self._joiner.join(self.indexes))
+
+
+class InsertValuesNode(ConfigMixin):
+    __slots__ = ('index', 'command', 'fields', 'rows')
+    _joiner = ', '
+    _template = '{command} INTO {index} ({fields}) VALUES {rows}'
+
+    def __init__(self, index=None, fields=None, replace=False):
+        super(InsertValuesNode, self).__init__()
+        self.index = index
+        self.command = 'REPLACE' if replace else 'INSERT'
+        self.fields = fields or ()
+        self.rows = []
+
+    def __bool__(self):
+        return bool(self.index and self.fields and self.rows)
+
+    def add_row(self, row):
+        values = []
+        for field in self.fields:
+            with InsertValueCtx(row.get(field)).with_config(self.config) as lex:
+                if lex is None:
+                    return None
+                values.append(lex)
+
+        row_lex = '(%s)' % self._joiner.join(values)
+        self.rows.append(row_lex)
+        return row_lex
+
+    def clear(self):
+        self.rows = []
+
+    def lex(self):
+        if not self:
+            return ''
+
+        fields = []
+        for field in self.fields:
+            with FieldCtx(field).with_config(self.config) as lex:
+                if lex is None:
+                    return ''
+                fields.append(lex)
+
+        return self._template.format(
+            command=self.command,
+            index=self.index,
+            fields=self._joiner.join(fields),
+            rows=self._joiner.join(self.rows),
+        )
+
+
 class OR(ConfigMixin):
+    __slots__ = ('raw_attrs', 'children', 'joiner')
     _wrapper = '(%s)'
     _joiner = ' OR '
 
@@ -399,6 +610,7 @@ class OR(ConfigMixin):
 
 
 class AggregateObject(ConfigMixin):
+    __slots__ = ('raw_attrs',)
     _agg_template = None
     _alias_template = None
 
@@ -428,9 +640,11 @@ class AggregateObject(ConfigMixin):
 
 
 class RawAttr(ConfigMixin):
+    __slots__ = ('field', 'alias')
     _template = '{field} AS {alias}'
 
     def __init__(self, field, alias):
+        super(RawAttr, self).__init__()
         self.field = field
         self.alias = alias
 
@@ -449,27 +663,161 @@ class RawAttr(ConfigMixin):
         return
 
 
+class SnippetAttr(RawAttr):
+    # SNIPPET() select expression, the options are validated
+    # as the CALL SNIPPETS ones but passed as 'option=value'.
+    __slots__ = ('query', 'options')
+    _snippet_template = "SNIPPET({field}, '{query}'{options})"
+    _option_template = ", '{option}={value}'"
+
+    def __init__(self, field, query, alias='snippet', **options):
+        super(SnippetAttr, self).__init__(field, alias)
+        self.query = query
+        self.options = options
+
+    def get_options_lex(self):
+        options_lex = ''
+        for option, value in sorted(self.options.items()):
+            options_ctx = SnippetsOptionsCtx(option, value).with_config(self.config)
+            with options_ctx as lex:
+                if not lex:
+                    continue
+            value = options_ctx.params
+            if isinstance(value, bool):
+                value = int(value)
+            options_lex += self._option_template.format(
+                option=option,
+                value=quote_string(six.text_type(value)),
+            )
+        return options_lex
+
+    def lex(self):
+        with FieldCtx(self.field).with_config(self.config) as field_lex:
+            if not field_lex:
+                return ''
+        with MatchQueryCtx(self.query).with_config(self.config) as query_lex:
+            if not query_lex:
+                return ''
+
+        snippet_lex = self._snippet_template.format(
+            field=field_lex,
+            query=query_lex,
+            options=self.get_options_lex(),
+        )
+        with AliasFieldCtx(
+            snippet_lex, self.alias
+        ).called_by(
+            self.__class__
+        ).with_config(
+            self.config
+        ) as lex:
+            return lex or ''
+
+
+class Interval(RawAttr):
+    # INTERVAL() is the number of the bucket, 0 for the values less than
+    # the first bound, 1 for the values between the first and the second...
+    __slots__ = ('attr', 'bounds')
+    _interval_template = 'INTERVAL({attr}, {bounds})'
+    _alias_template = '{attr}_interval'
+
+    def __init__(self, attr, bounds, alias=None):
+        self.attr = attr
+        self.bounds = list(bounds)
+        super(Interval, self).__init__(
+            self._interval_template.format(
+                attr=attr,
+                bounds=', '.join([six.text_type(b) for b in self.bounds]),
+            ),
+            alias or self._alias_template.format(attr=attr),
+        )
+
+    @property
+    def buckets_count(self):
+        return len(self.bounds) + 1
+
+    def get_range(self, bucket):
+        return (
+            self.bounds[bucket - 1] if bucket > 0 else None,
+            self.bounds[bucket] if bucket < len(self.bounds) else None,
+        )
+
+    def lex(self):
+        is_valid = (
+            self.bounds
+            and all([
+                isinstance(b, six.integer_types + (float,)) and not isinstance(b, bool)
+                for b in self.bounds
+            ])
+            and all([a < b for a, b in zip(self.bounds, self.bounds[1:])])
+        )
+        if not is_valid:
+            if self.is_strict:
+                raise SphinxQLSyntaxException(
+                    'INTERVAL bounds have to be ascending numbers, %s are not' % self.bounds
+                )
+            return ''
+        return super(Interval, self).lex()
+
+
+class Bucket(RawAttr):
+    # IDIV() is the number of the size wide bucket of the integer attribute
+    __slots__ = ('attr', 'size')
+    _bucket_template = 'IDIV({attr}, {size})'
+    _alias_template = '{attr}_bucket'
+    buckets_count = None
+
+    def __init__(self, attr, size, alias=None):
+        self.attr = attr
+        self.size = size
+        super(Bucket, self).__init__(
+            self._bucket_template.format(attr=attr, size=size),
+            alias or self._alias_template.format(attr=attr),
+        )
+
+    def get_range(self, bucket):
+        return bucket * self.size, (bucket + 1) * self.size
+
+    def lex(self):
+        if (
+            not isinstance(self.size, six.integer_types)
+            or isinstance(self.size, bool)
+            or self.size <= 0
+        ):
+            if self.is_strict:
+                raise SphinxQLSyntaxException(
+                    'The bucket size has to be positive integer, %s is not' % self.size
+                )
+            return ''
+        return super(Bucket, self).lex()
+
+
 class Avg(AggregateObject):
+    __slots__ = ()
     _agg_template = 'AVG({field}) AS {alias}'
     _alias_template = '{field}_avg'
 
 
 class Min(AggregateObject):
+    __slots__ = ()
     _agg_template = 'MIN({field}) AS {alias}'
     _alias_template = '{field}_min'
 
 
 class Max(AggregateObject):
+    __slots__ = ()
     _agg_template = 'MAX({field}) AS {alias}'
     _alias_template = '{field}_max'
 
 
 class Sum(AggregateObject):
+    __slots__ = ()
     _agg_template = 'SUM({field}) AS {alias}'
     _alias_template = '{field}_sum'
 
 
 class Count(AggregateObject):
+    __slots__ = ()
     _agg_template = 'COUNT(DISTINCT {field}) AS {alias}'
     _star_agg_template = 'COUNT({field}) AS {alias}'
     _alias_template = '{field}_count'
@@ -497,6 +845,7 @@ class Count(AggregateObject):
 
 
 class SnippetsOptionsContainer(ConfigMixin):
+    __slots__ = ('options',)
     _joiner = ', '
 
     def __init__(self):
@@ -519,6 +868,7 @@ class SnippetsOptionsContainer(ConfigMixin):
 
 
 class SnippetsQueryNode(ConfigMixin):
+    __slots__ = ('index', 'data', 'query')
     _joiner = ', '
     _template = "{data}, '{index}', '{query}'"
 
@@ -532,13 +882,20 @@ class SnippetsQueryNode(ConfigMixin):
         return all((self.index, self.data, self.query))
 
     def add_data(self, *data):
+        # Duplicates are kept, the snippets are returned one per document
         data = sparse_free_sequence(data)
         for value in data:
             value = string_from_string(value, self.is_strict)
-            if value and value not in self.data:
+            if value:
                 self.data.append(value)
         return self
 
+    def with_data(self, data):
+        query_node = SnippetsQueryNode(index=self.index).with_config(self.config)
+        query_node.data = data
+        query_node.query = self.query
+        return query_node
+
     def add_query(self, query):
         with MatchQueryCtx(query).with_config(self.config) as lex:
             if lex and lex not in self.query:
@@ -555,7 +912,7 @@ class SnippetsQueryNode(ConfigMixin):
             data_wrapper = "({data})"
 
         data = data_wrapper.format(
-            data=self._joiner.join(["'%s'" % d for d in self.data])
+            data=self._joiner.join(["'%s'" % quote_string(d) for d in self.data])
         )
 
         return self._template.format(
@@ -0,0 +1,100 @@
+"""
+    sphinxit.core.pagination
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Implements paginator with the next page prefetching.
+
+    :copyright: (c) 2013 by Roman Semirook.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from __future__ import unicode_literals
+
+import threading
+
+from sphinxit.core.helpers import LRUCache
+
+
+class PageCache(LRUCache):
+    # Small LRU cache of the page results, safe to share between
+    # the paginators and threads.
+    __slots__ = ()
+
+
+class Paginator(object):
+    __slots__ = (
+        'search',
+        'per_page',
+        'prefetch',
+        'cache',
+        'hits',
+        'misses',
+        '_prefetches',
+        '_lock',
+    )
+
+    def __init__(self, search, per_page=20, prefetch=True, cache=None, cache_size=10):
+        self.search = search
+        self.per_page = per_page
+        self.prefetch = prefetch
+        self.cache = cache if cache is not None else PageCache(max_size=cache_size)
+        self.hits = 0
+        self.misses = 0
+        self._prefetches = {}
+        self._lock = threading.Lock()
+
+    def get_page_search(self, number):
+        page_search = self.search.copy()
+        page_search._nodes.set_node('Limit', None)
+        return page_search.limit((number - 1) * self.per_page, self.per_page)
+
+    def _fetch(self, page_search):
+        alias = getattr(self.search, '_name', 'result')
+        result = page_search.ask(alias=alias)[alias]
+        self.cache.set(page_search.lex(), result)
+        return result
+
+    def _prefetch(self, page_search):
+        # Failed prefetch is not an error, the page is fetched on request
+        try:
+            self._fetch(page_search)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._prefetches.pop(page_search.lex(), None)
+
+    def _start_prefetch(self, number):
+        page_search = self.get_page_search(number)
+        key = page_search.lex()
+        # The thread is started under the lock, so page() never joins
+        # the registered but not started prefetch.
+        with self._lock:
+            if key in self._prefetches or self.cache.get(key) is not None:
+                return
+            prefetch = threading.Thread(target=self._prefetch, args=(page_search,))
+            prefetch.daemon = True
+            self._prefetches[key] = prefetch
+            prefetch.start()
+
+    def page(self, number):
+        # Returns the result of the page (starting from 1), the next page
+        # is fetched in the background if the current one is full.
+        page_search = self.get_page_search(number)
+        key = page_search.lex()
+        with self._lock:
+            prefetch = self._prefetches.get(key)
+        if prefetch is not None:
+            prefetch.join()
+
+        result = self.cache.get(key)
+        if result is None:
+            self.misses += 1
+            result = self._fetch(page_search)
+        else:
+            self.hits += 1
+
+        if self.prefetch and len(result['items']) >= self.per_page:
+            self._start_prefetch(number + 1)
+
+        return result
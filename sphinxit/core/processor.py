@@ -15,114 +15,159 @@ try:
 except ImportError:
     from ordereddict import OrderedDict
 
-from copy import deepcopy
+import hashlib
+import re
+import threading
 
 import six
 
-from sphinxit.core.helpers import sparse_free_sequence
+from sphinxit.core.helpers import (
+    is_sequence,
+    quote_string,
+    sparse_free_sequence,
+    string_from_string,
+)
 from sphinxit.core.nodes import (
     SelectFromContainer,
     AggregateObject,
     UpdateSetNode,
+    DeleteFromNode,
     FiltersContainer,
     LimitNode,
     GroupByNode,
     WithinGroupOrderByNode,
     OrderByContainer,
     OptionsContainer,
+    FacetsContainer,
     OR,
     SnippetsOptionsContainer,
     SnippetsQueryNode,
-    RawAttr
+    RawAttr,
+    Count,
 )
-from sphinxit.core.mixins import ConfigMixin
+from sphinxit.core.mixins import ConfigMixin, LexCacheMixin, cached_lex
 from sphinxit.core.constants import NODES_ORDER
+from sphinxit.core.exceptions import SphinxQLChainException
 from sphinxit.core.connector import SphinxConnector
 
 
 class LazySelectTree(ConfigMixin):
+    __slots__ = ('_indexes', '_nodes', '_owned')
 
     def __init__(self, indexes):
         self._indexes = indexes
-        self._nodes = OrderedDict([
-            ('SelectFrom', None),
-            ('UpdateSet', None),
-            ('Where', None),
-            ('GroupBy', None),
-            ('OrderBy', None),
-            ('WithinGroupOrderBy', None),
-            ('Limit', None),
-            ('Options', None),
-        ])
+        # Nodes are always fetched by name in NODES_ORDER order,
+        # so the plain dict is enough here.
+        self._nodes = {
+            'SelectFrom': None,
+            'UpdateSet': None,
+            'DeleteFrom': None,
+            'Where': None,
+            'GroupBy': None,
+            'OrderBy': None,
+            'WithinGroupOrderBy': None,
+            'Limit': None,
+            'Options': None,
+            'Facets': None,
+        }
+        self._owned = set()
         super(LazySelectTree, self).__init__()
 
     def __bool__(self):
-        return bool(self._nodes['SelectFrom'] or self._nodes['UpdateSet'])
+        return bool(
+            self._nodes['SelectFrom']
+            or self._nodes['UpdateSet']
+            or self._nodes['DeleteFrom']
+        )
 
     def copy(self):
+        # Nodes are shared by both trees after copying and neither of them
+        # owns them anymore, the node is copied on its first modification.
         new_tree = LazySelectTree(self._indexes).with_config(self.config)
         new_tree._indexes = self._indexes[:]
-        new_tree._nodes = deepcopy(self._nodes)
+        new_tree._nodes = self._nodes.copy()
+        self._owned = set()
         return new_tree
 
+    def _get_own_node(self, name, node_cls, **kwargs):
+        node = self._nodes[name]
+        if node is not None and name in self._owned:
+            return node
+
+        if node is None:
+            node = node_cls(**kwargs).with_config(self.config)
+        else:
+            node = node.copy()
+        self._nodes[name] = node
+        self._owned.add(name)
+
+        return node
+
     @property
     def SelectFrom(self):
-        if self._nodes['SelectFrom'] is None:
-            select_container = SelectFromContainer(indexes=self._indexes).with_config(self.config)
-            self._nodes['SelectFrom'] = select_container
-        return self._nodes['SelectFrom']
+        return self._get_own_node(
+            'SelectFrom',
+            SelectFromContainer,
+            indexes=self._indexes,
+        )
 
     @property
     def Where(self):
-        if self._nodes['Where'] is None:
-            filters_container = FiltersContainer().with_config(self.config)
-            self._nodes['Where'] = filters_container
-        return self._nodes['Where']
+        return self._get_own_node('Where', FiltersContainer)
 
     @property
     def GroupBy(self):
-        if self._nodes['GroupBy'] is None:
-            group_by_node = GroupByNode().with_config(self.config)
-            self._nodes['GroupBy'] = group_by_node
-        return self._nodes['GroupBy']
+        return self._get_own_node('GroupBy', GroupByNode)
 
     @property
     def OrderBy(self):
-        if self._nodes['OrderBy'] is None:
-            order_by_container = OrderByContainer().with_config(self.config)
-            self._nodes['OrderBy'] = order_by_container
-        return self._nodes['OrderBy']
+        return self._get_own_node('OrderBy', OrderByContainer)
 
     @property
     def WithinGroupOrderBy(self):
-        if self._nodes['WithinGroupOrderBy'] is None:
-            within_group_order_by_node = WithinGroupOrderByNode().with_config(self.config)
-            self._nodes['WithinGroupOrderBy'] = within_group_order_by_node
-        return self._nodes['WithinGroupOrderBy']
+        return self._get_own_node('WithinGroupOrderBy', WithinGroupOrderByNode)
 
     @property
     def Limit(self):
-        if self._nodes['Limit'] is None:
-            self._nodes['Limit'] = LimitNode().with_config(self.config)
-        return self._nodes['Limit']
+        return self._get_own_node('Limit', LimitNode)
 
     @property
     def Options(self):
-        if self._nodes['Options'] is None:
-            options_container = OptionsContainer().with_config(self.config)
-            self._nodes['Options'] = options_container
-        return self._nodes['Options']
+        return self._get_own_node('Options', OptionsContainer)
+
+    @property
+    def Facets(self):
+        return self._get_own_node('Facets', FacetsContainer)
 
     @property
     def UpdateSet(self):
-        if self._nodes['UpdateSet'] is None:
-            update_set_node = UpdateSetNode(indexes=self._indexes).with_config(self.config)
-            self._nodes['UpdateSet'] = update_set_node
-        return self._nodes['UpdateSet']
+        return self._get_own_node(
+            'UpdateSet',
+            UpdateSetNode,
+            indexes=self._indexes,
+        )
+
+    @property
+    def DeleteFrom(self):
+        return self._get_own_node(
+            'DeleteFrom',
+            DeleteFromNode,
+            indexes=self._indexes,
+        )
+
+    def get_node(self, name):
+        return self._nodes[name]
+
+    def set_node(self, name, node):
+        self._nodes[name] = node
+        self._owned.add(name)
 
     def is_update(self):
         return self._nodes['UpdateSet'] is not None
 
+    def is_delete(self):
+        return self._nodes['DeleteFrom'] is not None
+
     def get_select_nodes(self):
         if self._nodes['SelectFrom'] is None:
             select_container = SelectFromContainer(indexes=self._indexes).with_config(self.config)
@@ -133,8 +178,12 @@ class LazySelectTree(ConfigMixin):
     def get_update_nodes(self):
         return [self._nodes[n] for n in NODES_ORDER.update]
 
+    def get_delete_nodes(self):
+        return [self._nodes[n] for n in NODES_ORDER.delete]
+
 
 class LazySnippetsTree(ConfigMixin):
+    __slots__ = ('_index', '_snippets_syntax')
     _template = 'CALL SNIPPETS ({conditions})'
 
     def __init__(self, index):
@@ -164,24 +213,56 @@ class LazySnippetsTree(ConfigMixin):
             )
         return self._snippets_syntax['Options']
 
-    def lex(self):
+    def _lex_nodes(self, nodes):
         return self._template.format(
             conditions=', '.join([
                 x.lex()
-                for x in sparse_free_sequence(self._snippets_syntax.values())
+                for x in sparse_free_sequence(nodes)
             ])
         )
 
+    def lex(self):
+        return self._lex_nodes(self._snippets_syntax.values())
+
+    def get_fingerprint(self):
+        # Everything but the documents, the options order doesn't matter
+        options_node = self._snippets_syntax['Options']
+        return (
+            self._index,
+            ' '.join(self.SnippetQuery.query),
+            tuple(sorted(options_node.options if options_node else [])),
+        )
+
+    def lex_with_data(self, data):
+        return self._lex_nodes([
+            self.SnippetQuery.with_data(data),
+            self._snippets_syntax['Options'],
+        ])
+
 
 def copy_tree(method):
     def wrapper(self, *args, **kwargs):
-        self_copy = self.__class__(self.indexes, self.config, self.connector)
-        self_copy._nodes = self._nodes.copy()
-        return method(self_copy, *args, **kwargs)
+        return method(self.copy(), *args, **kwargs)
     return wrapper
 
 
-class Search(ConfigMixin):
+class Search(LexCacheMixin):
+    # Every chainable method works with a fresh copy, so the instance
+    # itself never changes after the query is built and its lex is cached.
+    __slots__ = ('_nodes', 'indexes', 'connector', '_name')
+    # searchd applies LIMIT 0,20 to the queries without explicit limit
+    _default_limit = (0, 20)
+    # Approximate count() stops matching after this number of documents
+    _default_count_cutoff = 10000
+    # searchd max_matches default, the deeper pages are not available
+    _default_max_matches = 1000
+    # DELETE queries are split even without MAX_QUERY_SIZE,
+    # it's well below the default searchd max_packet_size
+    _max_delete_size = 1024 * 1024
+    # searchd ranking without ORDER BY, the split queries are merged by it
+    _implicit_orderings = ('WEIGHT() DESC', 'id ASC')
+    _merge_key_template = 'merge_key_{0}'
+    _attr_re = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
 
     def __init__(self, indexes, config, connector=None):
         super(Search, self).__init__()
@@ -190,22 +271,29 @@ class Search(ConfigMixin):
         self.config = config
         self.connector = connector or SphinxConnector(config)
 
+    def copy(self):
+        self_copy = self.__class__(self.indexes, self.config, self.connector)
+        self_copy._nodes = self._nodes.copy()
+        return self_copy
+
     @copy_tree
     def select(self, *args, **kwargs):
+        # Keyword arguments are the aliases, so trusted is taken from them
+        trusted = kwargs.pop('trusted', None)
         if args:
             for field in args:
                 if isinstance(field, six.string_types):
-                    self._nodes.SelectFrom.add_field(field)
+                    self._nodes.SelectFrom.add_field(field, trusted=trusted)
                 if isinstance(field, (tuple, list)) and len(field) == 2:
                     field, alias = field
-                    self._nodes.SelectFrom.add_alias(field, alias)
+                    self._nodes.SelectFrom.add_alias(field, alias, trusted=trusted)
                 if isinstance(field, AggregateObject):
                     self._nodes.SelectFrom.add_aggregation(field)
                 if isinstance(field, RawAttr):
                     self._nodes.SelectFrom.add_raw_attr(field)
         if kwargs:
             for field, alias in kwargs.items():
-                self._nodes.SelectFrom.add_alias(field, alias)
+                self._nodes.SelectFrom.add_alias(field, alias, trusted=trusted)
 
         return self
 
@@ -216,6 +304,75 @@ class Search(ConfigMixin):
                 self._nodes.UpdateSet.update(field, value)
         return self
 
+    def bulk_update_queries(self, values_by_id, chunk_size=1000):
+        # Documents with the same new values are updated together
+        groups = OrderedDict()
+        for doc_id, values in values_by_id.items():
+            group_key = tuple(sorted([
+                (field, tuple(value) if is_sequence(value) else value)
+                for field, value in values.items()
+            ]))
+            if group_key not in groups:
+                groups[group_key] = (values, [])
+            groups[group_key][1].append(doc_id)
+
+        for values, ids in groups.values():
+            group_search = self.update(**values)
+            for i in range(0, len(ids), chunk_size):
+                yield group_search.filter(id__in=ids[i:i + chunk_size]).lex()
+
+    def bulk_update(self, values_by_id, chunk_size=1000, batch_size=10):
+        affected_rows = []
+        batch = []
+        for query in self.bulk_update_queries(values_by_id, chunk_size):
+            batch.append(query)
+            if len(batch) >= batch_size:
+                affected_rows.append(self.connector.execute_writes(batch))
+                batch = []
+        if batch:
+            affected_rows.append(self.connector.execute_writes(batch))
+
+        return affected_rows
+
+    def delete_queries(self, max_size=None):
+        # DELETE works with a single real-time index only
+        if len(self.indexes) != 1:
+            raise SphinxQLChainException(
+                'DELETE query works with one index, %s are given' % len(self.indexes)
+            )
+        delete_search = self.copy()
+        delete_search._nodes.set_node(
+            'DeleteFrom',
+            DeleteFromNode(indexes=self.indexes).with_config(self.config),
+        )
+        if not delete_search._nodes.get_node('Where'):
+            raise SphinxQLChainException(
+                'DELETE query without filters is not allowed'
+            )
+
+        max_size = (
+            max_size
+            or getattr(self.config, 'MAX_QUERY_SIZE', 0)
+            or self._max_delete_size
+        )
+        for chunk in delete_search.split(max_size):
+            yield chunk.lex()
+
+    def delete(self, max_size=None, batch_size=10):
+        # Huge IN filter is split into the queries not longer than max_size,
+        # the queries are sent in batches of batch_size queries per connection.
+        deleted_rows = 0
+        batch = []
+        for query in self.delete_queries(max_size):
+            batch.append(query)
+            if len(batch) >= batch_size:
+                deleted_rows += self.connector.execute_writes(batch)
+                batch = []
+        if batch:
+            deleted_rows += self.connector.execute_writes(batch)
+
+        return deleted_rows
+
     @copy_tree
     def match(self, query, raw=False):
         if not raw:
@@ -243,18 +400,30 @@ class Search(ConfigMixin):
         return self
 
     @copy_tree
-    def group_by(self, field):
-        self._nodes.GroupBy.by_field(field)
+    def group_by(self, field, per_group=None, trusted=None):
+        self._nodes.GroupBy.by_field(field, per_group, trusted=trusted)
         return self
 
+    def group_items(self, items):
+        # Splits the rows of GROUP N BY query back into the groups,
+        # the groups and their rows keep the order of the result.
+        group_by = self._nodes.get_node('GroupBy')
+        if not group_by:
+            raise SphinxQLChainException('The query is not grouped')
+
+        groups = OrderedDict()
+        for item in items:
+            groups.setdefault(item.get(group_by.field), []).append(item)
+        return groups
+
     @copy_tree
-    def within_group_order_by(self, field, ordering=None):
-        self._nodes.WithinGroupOrderBy.by_field(field, ordering)
+    def within_group_order_by(self, field, ordering=None, trusted=None):
+        self._nodes.WithinGroupOrderBy.by_field(field, ordering, trusted=trusted)
         return self
 
     @copy_tree
-    def order_by(self, field, ordering=None):
-        self._nodes.OrderBy.by_field(field, ordering)
+    def order_by(self, field, ordering=None, trusted=None):
+        self._nodes.OrderBy.by_field(field, ordering, trusted=trusted)
         return self
 
     @copy_tree
@@ -262,14 +431,26 @@ class Search(ConfigMixin):
         self._nodes.Options.set_options(**kwargs)
         return self
 
+    @copy_tree
+    def facet(self, field, order_by=None, ordering='desc', limit=None, trusted=None):
+        self._nodes.Facets.add_facet(field, order_by, ordering, limit, trusted=trusted)
+        return self
+
+    def get_facet_names(self):
+        facets_node = self._nodes.get_node('Facets')
+        return list(facets_node.names) if facets_node else []
+
     @copy_tree
     def named(self, name):
         self._name = name
         return self
 
+    @cached_lex
     def lex(self):
         if self._nodes.is_update():
             actual_nodes = self._nodes.get_update_nodes()
+        elif self._nodes.is_delete():
+            actual_nodes = self._nodes.get_delete_nodes()
         else:
             actual_nodes = self._nodes.get_select_nodes()
 
@@ -277,24 +458,306 @@ class Search(ConfigMixin):
             x.lex() for x in sparse_free_sequence(actual_nodes)
         ])
 
-    def ask(self, subqueries=None):
-        query_batch = [(self.lex(), getattr(self, '_name', 'result'))]
+    def count(self, approximate=False, cutoff=None):
+        # Fetches the single id with META to get total_found only,
+        # the approximate count is not greater than cutoff.
+        count_search = self.copy()
+        count_search._nodes.SelectFrom.minimize()
+        count_search._nodes.set_node('OrderBy', None)
+        count_search._nodes.set_node('WithinGroupOrderBy', None)
+        count_search._nodes.set_node('Limit', None)
+        count_search._nodes.set_node('Facets', None)
+        count_search = count_search.limit(0, 1)
+
+        options_node = count_search._nodes.get_node('Options')
+        has_cutoff = options_node and any([
+            option.startswith('cutoff=') for option in options_node.options
+        ])
+        if approximate and not has_cutoff:
+            count_search = count_search.options(
+                cutoff=cutoff or self._default_count_cutoff
+            )
+
+        result = self.connector.execute(
+            [(count_search.lex(), 'count')],
+            with_meta=True,
+            with_status=False,
+        )
+        return int(result['count']['meta']['total_found'])
+
+    def histogram(self, bucket, max_buckets=1000):
+        # Groups the documents by Interval or Bucket expression, only
+        # the counts of the buckets are fetched. Empty buckets between
+        # the found ones are not returned for Bucket expressions.
+        histogram_search = self.copy()
+        histogram_search._nodes.SelectFrom.minimize()
+        for name in ('GroupBy', 'OrderBy', 'WithinGroupOrderBy', 'Limit', 'Facets'):
+            histogram_search._nodes.set_node(name, None)
+
+        buckets_count = bucket.buckets_count or max_buckets
+        histogram_search = (
+            histogram_search
+            .select(bucket, Count(alias='bucket_count'))
+            .group_by(bucket.alias)
+            .limit(0, buckets_count)
+        )
+        result = self.connector.execute(
+            [(histogram_search.lex(), 'histogram')],
+            with_meta=False,
+            with_status=False,
+        )
+        counts = dict([
+            (int(item[bucket.alias]), int(item['bucket_count']))
+            for item in result['histogram']['items']
+        ])
+
+        histogram = []
+        buckets = range(bucket.buckets_count) if bucket.buckets_count else sorted(counts)
+        for number in buckets:
+            range_from, range_to = bucket.get_range(number)
+            histogram.append({
+                'bucket': number,
+                'from': range_from,
+                'to': range_to,
+                'count': counts.get(number, 0),
+            })
+        return histogram
+
+    def get_max_matches(self):
+        options_node = self._nodes.get_node('Options')
+        for option in (options_node.options if options_node else []):
+            if option.startswith('max_matches='):
+                return int(option.split('=', 1)[1])
+        return None
+
+    def scan(self, batch_size=1000):
+        # Keyset pagination, every page is the next batch_size documents
+        # with id greater than the last seen one. The page cost doesn't
+        # depend on its depth and max_matches is never exceeded.
+        if self._nodes.get_node('OrderBy') or self._nodes.get_node('GroupBy'):
+            raise SphinxQLChainException(
+                'scan() orders the documents by id, '
+                'ordered and grouped queries are not supported'
+            )
+
+        max_matches = self.get_max_matches()
+        scan_search = self.order_by('id', 'asc')
+        scan_search._nodes.set_node('Limit', None)
+        # The last id is the key of the next page, it's selected even if
+        # the fields are explicit and removed from the documents then.
+        select_from = self._nodes.get_node('SelectFrom')
+        adds_id = bool(
+            select_from
+            and select_from.fields
+            and not set(['id', '*']).intersection(select_from.fields)
+        )
+        if adds_id:
+            scan_search = scan_search.select('id')
+        if max_matches is not None:
+            batch_size = min(batch_size, max_matches)
+        elif batch_size > self._default_max_matches:
+            scan_search = scan_search.options(max_matches=batch_size)
+
+        alias = getattr(self, '_name', 'result')
+        page_search = scan_search
+        while True:
+            items = page_search.limit(0, batch_size).ask(alias=alias)[alias]['items']
+            if not items:
+                return
+            last_id = items[-1]['id']
+            for item in items:
+                if adds_id:
+                    item.pop('id', None)
+                yield item
+            if len(items) < batch_size:
+                return
+            page_search = scan_search.filter(id__gt=last_id)
+
+    def get_limit(self):
+        limit_node = self._nodes.get_node('Limit')
+        if limit_node:
+            return limit_node.offset, limit_node.limit
+        return self._default_limit
+
+    def _get_merge_keys(self):
+        # Returns the (column, descending, expression) sort keys of the
+        # merged chunks. searchd sorts by WEIGHT() DESC, id ASC without
+        # ORDER BY. The expression is None if the column is selected by
+        # the query itself, otherwise the chunks select it additionally
+        # and merge_results() drops it.
+        select_from = self._nodes.get_node('SelectFrom')
+        fields = select_from.fields + select_from.or_fields if select_from else []
+        columns = set()
+        aliases = {}
+        for field in fields:
+            expression, _, alias = field.rpartition(' AS ')
+            columns.add(alias)
+            if expression:
+                aliases[expression.lower()] = alias
+        has_star = not select_from or not select_from.fields or '*' in columns
+
+        order_by = self._nodes.get_node('OrderBy')
+        orderings = order_by.orderings if order_by else self._implicit_orderings
+        merge_keys = []
+        for ordering in orderings:
+            field, direction = ordering.rsplit(' ', 1)
+            descending = direction.upper() == 'DESC'
+            if field in columns or (has_star and self._attr_re.match(field)):
+                merge_keys.append((field, descending, None))
+            elif field.lower() in aliases:
+                merge_keys.append((aliases[field.lower()], descending, None))
+            elif self._attr_re.match(field):
+                merge_keys.append((field, descending, field))
+            else:
+                column = self._merge_key_template.format(len(merge_keys))
+                merge_keys.append((
+                    column,
+                    descending,
+                    '{0} AS {1}'.format(field, column),
+                ))
+
+        return merge_keys
+
+    def split(self, max_size=None):
+        # Splits the query longer than max_size bytes (MAX_QUERY_SIZE by
+        # default) into the queries with the chunks of its id IN filter. Every chunk
+        # fetches offset + limit rows with the sort keys, merge_results()
+        # merges them back. The chunks never share the documents.
+        if max_size is None:
+            max_size = getattr(self.config, 'MAX_QUERY_SIZE', 0)
+        # The size is in bytes, as the searchd packet is
+        lex_size = len(self.lex().encode('utf-8'))
+        if not max_size or lex_size <= max_size:
+            return [self]
+
+        if (
+            self._nodes.is_update()
+            or self._nodes.get_node('GroupBy')
+            or self._nodes.get_node('Facets')
+        ):
+            raise SphinxQLChainException(
+                'The query is longer than %s and can not be split, '
+                'grouped, faceted and UPDATE queries are not supported' % max_size
+            )
+
+        # DELETE queries have no LIMIT and their chunks are not merged
+        chunk_search = self.copy()
+        if not self._nodes.is_delete():
+            offset, limit = self.get_limit()
+            chunk_limit = LimitNode().with_config(self.config)
+            chunk_limit.set_range(0, offset + limit)
+            chunk_search._nodes.set_node('Limit', chunk_limit)
+
+            expressions = [e for _, _, e in self._get_merge_keys() if e]
+            if expressions:
+                select_from = chunk_search._nodes.SelectFrom
+                if not select_from.fields:
+                    select_from.fields.append('*')
+                select_from.fields.extend(expressions)
+
+        where = self._nodes.get_node('Where')
+        chunks = []
+        if where:
+            chunks = where.split_in_condition(
+                max_size - (
+                    len(chunk_search.lex().encode('utf-8'))
+                    - len(where.lex().encode('utf-8'))
+                ),
+                attr='id',
+            )
+        if not chunks:
+            raise SphinxQLChainException(
+                'The query is longer than %s and has no id IN filter '
+                'to be split with' % max_size
+            )
+
+        searches = []
+        for chunk_where in chunks:
+            search = chunk_search.copy()
+            search._nodes.set_node('Where', chunk_where)
+            searches.append(search)
+
+        return searches
+
+    def merge_results(self, chunk_results):
+        items = []
+        for chunk_result in chunk_results:
+            items.extend(chunk_result['items'])
+
+        merge_keys = self._get_merge_keys()
+        for column, descending, _ in reversed(merge_keys):
+            items.sort(
+                key=lambda item: (item.get(column) is not None, item.get(column)),
+                reverse=descending,
+            )
+
+        offset, limit = self.get_limit()
+        items = items[offset:offset + limit]
+        for column, _, expression in merge_keys:
+            if expression:
+                for item in items:
+                    item.pop(column, None)
+
+        result = dict(chunk_results[0])
+        result['items'] = items
+        if 'meta' in result:
+            result['meta'] = dict(result['meta'])
+            for key in ('total', 'total_found'):
+                if key in result['meta']:
+                    result['meta'][key] = six.text_type(sum([
+                        int(r['meta'][key]) for r in chunk_results
+                    ]))
+
+        return result
+
+    def ask(self, subqueries=None, alias=None):
+        # The chained copies are not named, the alias of the main
+        # query can be passed explicitly.
+        searches = [(self, alias or getattr(self, '_name', 'result'))]
         if subqueries is not None:
-            query_batch.extend([
-                (s_inst.lex(), getattr(s_inst, '_name', 'result_%s' % id(s_inst)))
+            searches.extend([
+                (s_inst, getattr(s_inst, '_name', 'result_%s' % id(s_inst)))
                 for s_inst in subqueries
             ])
-        return self.connector.execute(query_batch)
+
+        query_batch = []
+        split_searches = []
+        for search, alias in searches:
+            chunks = search.split()
+            if len(chunks) == 1:
+                facet_names = search.get_facet_names()
+                if facet_names:
+                    query_batch.append((search.lex(), alias, facet_names))
+                else:
+                    query_batch.append((search.lex(), alias))
+                continue
+
+            chunk_aliases = ['%s_chunk_%s' % (alias, i) for i in range(len(chunks))]
+            query_batch.extend(zip([c.lex() for c in chunks], chunk_aliases))
+            split_searches.append((search, alias, chunk_aliases))
+
+        results = self.connector.execute(query_batch)
+        for search, alias, chunk_aliases in split_searches:
+            results[alias] = search.merge_results([
+                results.pop(chunk_alias) for chunk_alias in chunk_aliases
+            ])
+
+        return results
 
 
 class Snippet(ConfigMixin):
+    __slots__ = ('_snippets_tree', 'index', 'connector', 'cache')
+    # The batches are split even without MAX_QUERY_SIZE,
+    # it's well below the default searchd max_packet_size
+    _max_batch_size = 1024 * 1024
 
-    def __init__(self, index=None, config=None, connector=None):
+    def __init__(self, index=None, config=None, connector=None, cache=None):
         super(Snippet, self).__init__()
         self._snippets_tree = LazySnippetsTree(index=index).with_config(config)
         self.index = index
         self.config = config
         self.connector = connector or SphinxConnector(config)
+        self.cache = cache
 
     def from_data(self, *args):
         self._snippets_tree.SnippetQuery.add_data(*args)
@@ -313,3 +776,105 @@ class Snippet(ConfigMixin):
 
     def ask(self):
         return self.connector.execute(self.lex())
+
+    def batch_queries(self, documents, max_size=None):
+        # Every document is sent, in the same order, so the snippets
+        # are aligned with the documents. The queries are not longer
+        # than max_size bytes, unless the single document is longer.
+        max_size = (
+            max_size
+            or getattr(self.config, 'MAX_QUERY_SIZE', 0)
+            or self._max_batch_size
+        )
+        base_size = len(self._snippets_tree.lex_with_data(['']).encode('utf-8')) + 2
+
+        chunks = [[]]
+        chunk_size = base_size
+        for document in documents:
+            document = self._normalize_document(document)
+            # The quoted document with its comma and space
+            document_size = len(quote_string(document).encode('utf-8')) + 4
+            if chunks[-1] and chunk_size + document_size > max_size:
+                chunks.append([])
+                chunk_size = base_size
+            chunks[-1].append(document)
+            chunk_size += document_size
+
+        return [
+            self._snippets_tree.lex_with_data(chunk)
+            for chunk in chunks if chunk
+        ]
+
+    def _normalize_document(self, document):
+        return string_from_string(document, self.is_strict) or ''
+
+    def ask_batch(self, documents, max_size=None, workers_count=None):
+        # Returns the list of snippets, one per document. Only the documents
+        # missed in the cache are sent to searchd, every one of them once.
+        if self.cache is None:
+            return self._ask_batch(documents, max_size, workers_count)
+
+        fingerprint = self._snippets_tree.get_fingerprint()
+        keys = []
+        snippets = []
+        missed = OrderedDict()
+        for document in documents:
+            document = self._normalize_document(document)
+            key = (fingerprint, hashlib.sha1(document.encode('utf-8')).hexdigest())
+            snippet = self.cache.get(key)
+            if snippet is None:
+                missed[key] = document
+            keys.append(key)
+            snippets.append(snippet)
+
+        if missed:
+            fetched = dict(zip(
+                missed.keys(),
+                self._ask_batch(list(missed.values()), max_size, workers_count),
+            ))
+            for key, snippet in fetched.items():
+                self.cache.set(key, snippet)
+            snippets = [
+                snippet if snippet is not None else fetched[key]
+                for key, snippet in zip(keys, snippets)
+            ]
+
+        return snippets
+
+    def _ask_batch(self, documents, max_size=None, workers_count=None):
+        # The queries are executed in parallel,
+        # every one with its pooled connection.
+        queries = self.batch_queries(documents, max_size)
+        results = [None] * len(queries)
+        errors = []
+
+        def execute(numbers):
+            for number in numbers:
+                try:
+                    results[number] = self.connector.execute(queries[number])
+                except Exception as e:
+                    errors.append(e)
+
+        workers_count = min(
+            workers_count or getattr(self.config, 'POOL_SIZE', 5),
+            len(queries),
+        )
+        if workers_count > 1:
+            workers = [
+                threading.Thread(
+                    target=execute,
+                    args=(range(i, len(queries), workers_count),),
+                )
+                for i in range(workers_count)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        else:
+            execute(range(len(queries)))
+
+        if errors:
+            raise errors[0]
+
+        return [row['snippet'] for result in results for row in result]
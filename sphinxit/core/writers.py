@@ -0,0 +1,743 @@
+"""
+    sphinxit.core.writers
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Implements batched writes into real-time indexes.
+
+    :copyright: (c) 2013 by Roman Semirook.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from __future__ import unicode_literals
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from six.moves import queue
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from sphinxit.core.exceptions import (
+    ImproperlyConfigured,
+    SphinxQLConnectionException,
+    SphinxQLDriverException,
+)
+from sphinxit.core.convertors import FieldCtx
+from sphinxit.core.nodes import InsertValuesNode
+from sphinxit.core.mixins import ConfigMixin
+from sphinxit.core.connector import SphinxConnector
+from sphinxit.core.processor import Search
+
+
+class WriteAheadLog(object):
+    __slots__ = (
+        'path',
+        'offset_path',
+        '_log',
+        '_lock',
+    )
+
+    # Every record is the length prefixed JSON of [rows_count, statements]
+    _header = struct.Struct('>I')
+
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = path + '.offset'
+        self._log = open(path, 'ab')
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._log.close()
+
+    def get_offset(self):
+        try:
+            with open(self.offset_path) as offset_file:
+                return int(offset_file.read() or 0)
+        except (IOError, OSError):
+            return 0
+
+    def _set_offset(self, offset):
+        # The offset is replaced atomically, the crash in the middle
+        # leaves the previous one.
+        tmp_path = self.offset_path + '.tmp'
+        with open(tmp_path, 'w') as offset_file:
+            offset_file.write(str(offset))
+            offset_file.flush()
+            os.fsync(offset_file.fileno())
+        os.rename(tmp_path, self.offset_path)
+
+    def is_empty(self):
+        with self._lock:
+            return os.path.getsize(self.path) <= self.get_offset()
+
+    def append(self, statements, rows_count):
+        record = json.dumps([rows_count, statements]).encode('utf-8')
+        with self._lock:
+            self._log.write(self._header.pack(len(record)) + record)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+    def records(self):
+        # Yields (next_offset, statements, rows_count) from the last
+        # committed offset, the records appended after the start are
+        # left for the next call. Incomplete record at the end is skipped.
+        with self._lock:
+            size = os.path.getsize(self.path)
+            offset = self.get_offset()
+        if size <= offset:
+            return
+
+        with open(self.path, 'rb') as log:
+            data = mmap.mmap(log.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                while offset + self._header.size <= size:
+                    length, = self._header.unpack_from(data, offset)
+                    start = offset + self._header.size
+                    if start + length > size:
+                        return
+                    rows_count, statements = json.loads(
+                        data[start:start + length].decode('utf-8')
+                    )
+                    offset = start + length
+                    yield offset, statements, rows_count
+            finally:
+                data.close()
+
+    def commit(self, offset):
+        # Fully replayed log is truncated
+        with self._lock:
+            if offset >= os.path.getsize(self.path):
+                self._log.truncate(0)
+                offset = 0
+            self._set_offset(offset)
+
+
+class RTWriter(ConfigMixin):
+    __slots__ = (
+        'index',
+        'connector',
+        'replace',
+        'max_rows',
+        'max_bytes',
+        'max_delay',
+        'wal',
+        '_buffers',
+        '_pending_rows',
+        '_pending_bytes',
+        '_pending_since',
+        'rows_written',
+        'flushes_count',
+        'write_time',
+    )
+
+    def __init__(
+        self,
+        index,
+        config,
+        connector=None,
+        replace=False,
+        max_rows=1000,
+        max_bytes=1024 * 1024,
+        max_delay=1.0,
+        wal=None,
+    ):
+        super(RTWriter, self).__init__()
+        self.index = index
+        self.config = config
+        self.connector = connector or SphinxConnector(config)
+        self.replace = replace
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.wal = wal
+        self._buffers = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        self._pending_since = None
+        self.rows_written = 0
+        self.flushes_count = 0
+        self.write_time = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self):
+        return self._pending_rows
+
+    @property
+    def rows_per_second(self):
+        if not self.write_time:
+            return 0.0
+        return self.rows_written / self.write_time
+
+    def _get_buffer(self, fields):
+        # The row with another set of fields starts the next statement,
+        # so the statements are written in the order of rows.
+        if self._buffers and self._buffers[-1].fields == fields:
+            return self._buffers[-1]
+
+        for field in fields:
+            with FieldCtx(field).with_config(self.config) as lex:
+                if lex is None:
+                    return None
+
+        values_node = InsertValuesNode(
+            index=self.index,
+            fields=fields,
+            replace=self.replace,
+        ).with_config(self.config)
+        self._buffers.append(values_node)
+        return values_node
+
+    def buffer(self, row):
+        # The consecutive rows with the same set of fields share the
+        # statement, "id" always goes first. Invalid row is not buffered.
+        fields = tuple(sorted(row, key=lambda field: (field != 'id', field)))
+        values_node = self._get_buffer(fields)
+        if values_node is None:
+            return False
+        row_lex = values_node.add_row(row)
+        if row_lex is None:
+            return False
+
+        if self._pending_since is None:
+            self._pending_since = time.time()
+        self._pending_rows += 1
+        self._pending_bytes += len(row_lex.encode('utf-8')) + 2
+        return True
+
+    def add(self, row):
+        if self.buffer(row) and self.is_full():
+            return self.flush()
+        return 0
+
+    def add_rows(self, rows):
+        affected_rows = 0
+        for row in rows:
+            affected_rows += self.add(row)
+        return affected_rows
+
+    def is_full(self):
+        # Any of the limits can be turned off with None
+        if not self._pending_rows:
+            return False
+        if self.max_rows is not None and self._pending_rows >= self.max_rows:
+            return True
+        if self.max_bytes is not None and self._pending_bytes >= self.max_bytes:
+            return True
+        return (
+            self.max_delay is not None
+            and time.time() - self._pending_since >= self.max_delay
+        )
+
+    def get_statements(self):
+        statements = [
+            values_node.lex()
+            for values_node in self._buffers
+            if values_node
+        ]
+        return statements, self._pending_rows
+
+    def clear(self):
+        self._buffers = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        self._pending_since = None
+
+    def pop_statements(self):
+        statements, rows_count = self.get_statements()
+        self.clear()
+        return statements, rows_count
+
+    def write(self, statements, rows_count):
+        started_at = time.time()
+        affected_rows = self.connector.execute_writes(statements)
+        self.write_time += time.time() - started_at
+        self.rows_written += rows_count
+        self.flushes_count += 1
+        return affected_rows
+
+    def write_or_log(self, statements, rows_count):
+        # Batches that failed because searchd is unreachable are appended
+        # to the log if there is one, the rest of errors are raised. While
+        # the log is not replayed, the new batches go after it to keep
+        # the order of writes.
+        if self.wal is None:
+            return self.write(statements, rows_count)
+
+        if self.wal.is_empty():
+            try:
+                return self.write(statements, rows_count)
+            except SphinxQLConnectionException:
+                pass
+        self.wal.append(statements, rows_count)
+        return 0
+
+    def flush(self):
+        # The rows are buffered until they are written or logged, the
+        # failed flush without the log can be repeated.
+        statements, rows_count = self.get_statements()
+        if not statements:
+            return 0
+        affected_rows = self.write_or_log(statements, rows_count)
+        self.clear()
+        return affected_rows
+
+    def replay(self, max_rate=None, on_error=None):
+        # Writes the logged batches in order, not faster than max_rate
+        # rows per second. Stops if searchd is unreachable, the batch is
+        # kept for the next replay. The batch that searchd rejects is
+        # raised, or passed to on_error(statements, rows_count, error)
+        # and skipped.
+        rows_replayed = 0
+        for offset, statements, rows_count in self.wal.records():
+            started_at = time.time()
+            try:
+                self.write(statements, rows_count)
+            except SphinxQLConnectionException:
+                break
+            except SphinxQLDriverException as e:
+                if on_error is None:
+                    raise
+                on_error(statements, rows_count, e)
+                self.wal.commit(offset)
+                continue
+            self.wal.commit(offset)
+            rows_replayed += rows_count
+            if max_rate:
+                time.sleep(max(0, rows_count / float(max_rate) - (time.time() - started_at)))
+        return rows_replayed
+
+    def lex(self):
+        return '; '.join([
+            values_node.lex()
+            for values_node in self._buffers
+            if values_node
+        ])
+
+
+class RTPipeline(ConfigMixin):
+    __slots__ = (
+        'index',
+        'connector',
+        'replace',
+        'batch_rows',
+        'batch_bytes',
+        'workers_count',
+        'queue_size',
+        'retries',
+        'retry_delay',
+        'progress',
+        'rows_read',
+        'rows_written',
+        'batches_written',
+        'batches_failed',
+        'retries_count',
+        'errors',
+        'started_at',
+        'finished_at',
+        '_lock',
+    )
+
+    def __init__(
+        self,
+        index,
+        config,
+        connector=None,
+        replace=False,
+        batch_rows=1000,
+        batch_bytes=1024 * 1024,
+        workers_count=None,
+        queue_size=None,
+        retries=3,
+        retry_delay=1.0,
+        progress=None,
+    ):
+        super(RTPipeline, self).__init__()
+        self.index = index
+        self.config = config
+        self.connector = connector or SphinxConnector(config)
+        self.replace = replace
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        self.workers_count = workers_count or getattr(config, 'POOL_SIZE', 5)
+        self.queue_size = queue_size or self.workers_count * 2
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.progress = progress
+        self.rows_read = 0
+        self.rows_written = 0
+        self.batches_written = 0
+        self.batches_failed = 0
+        self.retries_count = 0
+        self.errors = []
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def stats(self):
+        elapsed = (self.finished_at or time.time()) - (self.started_at or time.time())
+        return {
+            'rows_read': self.rows_read,
+            'rows_written': self.rows_written,
+            'batches_written': self.batches_written,
+            'batches_failed': self.batches_failed,
+            'retries': self.retries_count,
+            'elapsed': elapsed,
+            'rows_per_second': self.rows_written / elapsed if elapsed else 0.0,
+        }
+
+    def _write_batch(self, statements, rows_count):
+        for attempt in range(self.retries + 1):
+            try:
+                self.connector.execute_writes(statements, transaction=True)
+            except Exception as e:
+                error = e
+                if attempt < self.retries:
+                    with self._lock:
+                        self.retries_count += 1
+                    time.sleep(self.retry_delay)
+                continue
+
+            with self._lock:
+                self.rows_written += rows_count
+                self.batches_written += 1
+                if self.progress is not None:
+                    self.progress(self.stats())
+            return
+
+        with self._lock:
+            self.batches_failed += 1
+            self.errors.append(error)
+
+    def _work(self, batches):
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            self._write_batch(*batch)
+
+    def run(self, rows):
+        # Rows are read and batched in the calling thread, batches are
+        # written by the workers. The bounded queue blocks the reading
+        # while all of the workers are busy.
+        batches = queue.Queue(maxsize=self.queue_size)
+        workers = [
+            threading.Thread(target=self._work, args=(batches,))
+            for _ in range(self.workers_count)
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        writer = RTWriter(
+            self.index,
+            self.config,
+            connector=self.connector,
+            replace=self.replace,
+            max_rows=self.batch_rows,
+            max_bytes=self.batch_bytes,
+            max_delay=None,
+        )
+        self.started_at = time.time()
+        self.finished_at = None
+        try:
+            for row in rows:
+                self.rows_read += 1
+                if writer.buffer(row) and writer.is_full():
+                    batches.put(writer.pop_statements())
+            statements, rows_count = writer.pop_statements()
+            if statements:
+                batches.put((statements, rows_count))
+        finally:
+            for _ in workers:
+                batches.put(None)
+            for worker in workers:
+                worker.join()
+            self.finished_at = time.time()
+
+        if self.errors:
+            raise SphinxQLDriverException(
+                '%s batches were not written after %s retries, the last error: %s' %
+                (self.batches_failed, self.retries, self.errors[-1])
+            )
+
+        return self.stats()
+
+
+class ShardedRTWriter(ConfigMixin):
+    __slots__ = (
+        'index',
+        'hash_func',
+        'writers',
+        'errors',
+        '_flushes',
+        '_failed',
+        '_lock',
+    )
+
+    def __init__(self, index, config, shards, hash_func=None, wals=None, **writer_options):
+        # Shards are SEARCHD_CONNECTION-like dicts or connector instances,
+        # the document goes to the shards[hash_func(id) % len(shards)].
+        # Every shard has its own log, the wals are in the shards order.
+        super(ShardedRTWriter, self).__init__()
+        if 'wal' in writer_options:
+            raise ImproperlyConfigured(
+                'The shards can not share the log, pass the list of wals instead'
+            )
+        if wals is None:
+            wals = [None] * len(shards)
+        if len(wals) != len(shards):
+            raise ImproperlyConfigured(
+                '%s wals are given for %s shards' % (len(wals), len(shards))
+            )
+
+        self.index = index
+        self.config = config
+        self.hash_func = hash_func or int
+        self.writers = []
+        for shard, wal in zip(shards, wals):
+            if isinstance(shard, dict):
+                shard = SphinxConnector(config, searchd_connection=shard)
+            self.writers.append(
+                RTWriter(index, config, connector=shard, wal=wal, **writer_options)
+            )
+        self.errors = []
+        self._flushes = [None] * len(self.writers)
+        # Failed batches of every shard, they are written first on the
+        # next flush of the shard.
+        self._failed = [[] for _ in self.writers]
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self):
+        return sum([len(writer) for writer in self.writers]) + sum([
+            rows_count
+            for batches in self._failed
+            for _, rows_count in batches
+        ])
+
+    @property
+    def rows_written(self):
+        return sum([writer.rows_written for writer in self.writers])
+
+    def get_shard(self, doc_id):
+        return self.hash_func(doc_id) % len(self.writers)
+
+    def stats(self):
+        return [
+            {
+                'rows_written': writer.rows_written,
+                'flushes_count': writer.flushes_count,
+                'rows_per_second': writer.rows_per_second,
+            }
+            for writer in self.writers
+        ]
+
+    def _write(self, shard, batches):
+        # The failed batch and the rest after it are kept in order
+        for i, (statements, rows_count) in enumerate(batches):
+            try:
+                self.writers[shard].write_or_log(statements, rows_count)
+            except Exception as e:
+                with self._lock:
+                    self.errors.append(e)
+                    self._failed[shard] = batches[i:]
+                return
+
+    def _start_flush(self, shard):
+        # Only one flush per shard is in progress, the shards are
+        # flushed in parallel to each other.
+        self._wait_flush(shard)
+        batches, self._failed[shard] = self._failed[shard], []
+        statements, rows_count = self.writers[shard].pop_statements()
+        if statements:
+            batches.append((statements, rows_count))
+        if batches:
+            flush = threading.Thread(
+                target=self._write,
+                args=(shard, batches),
+            )
+            flush.daemon = True
+            flush.start()
+            self._flushes[shard] = flush
+
+    def _wait_flush(self, shard):
+        if self._flushes[shard] is not None:
+            self._flushes[shard].join()
+            self._flushes[shard] = None
+
+    def _raise_errors(self):
+        if self.errors:
+            errors, self.errors = self.errors, []
+            raise SphinxQLDriverException(
+                '%s shard flushes failed, the last error: %s' %
+                (len(errors), errors[-1])
+            )
+
+    def add(self, row):
+        shard = self.get_shard(row['id'])
+        writer = self.writers[shard]
+        if writer.buffer(row) and writer.is_full():
+            self._raise_errors()
+            self._start_flush(shard)
+
+    def add_rows(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def flush(self):
+        for shard in range(len(self.writers)):
+            self._start_flush(shard)
+        for shard in range(len(self.writers)):
+            self._wait_flush(shard)
+        self._raise_errors()
+
+    def replay(self, max_rate=None):
+        # Replays the logs of the shards one by one, max_rate is per shard
+        return sum([
+            writer.replay(max_rate)
+            for writer in self.writers
+            if writer.wal is not None
+        ])
+
+
+class UpdateBuffer(ConfigMixin):
+    __slots__ = (
+        'connector',
+        'max_delay',
+        'chunk_size',
+        'batch_size',
+        'values_received',
+        'values_written',
+        'flushes_count',
+        'last_flush_latency',
+        'max_flush_latency',
+        '_pending',
+        '_pending_since',
+        '_lock',
+    )
+
+    def __init__(
+        self,
+        config,
+        connector=None,
+        max_delay=1.0,
+        chunk_size=1000,
+        batch_size=10,
+    ):
+        super(UpdateBuffer, self).__init__()
+        self.config = config
+        self.connector = connector or SphinxConnector(config)
+        self.max_delay = max_delay
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.values_received = 0
+        self.values_written = 0
+        self.flushes_count = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self._pending = OrderedDict()
+        self._pending_since = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self):
+        return sum([len(values_by_id) for values_by_id in self._pending.values()])
+
+    @property
+    def coalescing_ratio(self):
+        # How many received values are written with every written value
+        if not self.values_written:
+            return 1.0
+        return self.values_received / float(self.values_written)
+
+    def update(self, index, doc_id, **kwargs):
+        # Only the last value of the document attribute is kept
+        with self._lock:
+            if self._pending_since is None:
+                self._pending_since = time.time()
+            values_by_id = self._pending.setdefault(index, OrderedDict())
+            values_by_id.setdefault(doc_id, {}).update(kwargs)
+            self.values_received += len(kwargs)
+            is_expired = (
+                self.max_delay is not None
+                and time.time() - self._pending_since >= self.max_delay
+            )
+
+        if is_expired:
+            return self.flush()
+        return 0
+
+    def _restore(self, pending, pending_since):
+        # Puts the not written values back before the received meanwhile,
+        # the newer values of the same attributes win.
+        restored = OrderedDict()
+        for index, values_by_id in pending.items():
+            for doc_id, values in self._pending.pop(index, {}).items():
+                values_by_id.setdefault(doc_id, {}).update(values)
+            restored[index] = values_by_id
+        restored.update(self._pending)
+        self._pending = restored
+        self._pending_since = pending_since
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+            pending_since, self._pending_since = self._pending_since, None
+        if not pending:
+            return 0
+
+        affected_rows = 0
+        written_indexes = []
+        try:
+            for index, values_by_id in pending.items():
+                search = Search([index], self.config, connector=self.connector)
+                affected_rows += sum(search.bulk_update(
+                    values_by_id,
+                    chunk_size=self.chunk_size,
+                    batch_size=self.batch_size,
+                ))
+                written_indexes.append(index)
+        except Exception:
+            with self._lock:
+                for index in written_indexes:
+                    del pending[index]
+                self._restore(pending, pending_since)
+            raise
+
+        latency = time.time() - pending_since
+        with self._lock:
+            self.values_written += sum([
+                len(values)
+                for values_by_id in pending.values()
+                for values in values_by_id.values()
+            ])
+            self.flushes_count += 1
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+
+        return affected_rows
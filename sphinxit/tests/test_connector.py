@@ -0,0 +1,217 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sphinxit.core.connector import SphinxConnector
+from sphinxit.core.exceptions import SphinxQLConnectionException
+from sphinxit.core.helpers import BaseSearchConfig
+
+
+class MetaCacheConfig(BaseSearchConfig):
+    WITH_STATUS = False
+    META_CACHE_TTL = 60
+
+
+class FakeCursor(object):
+
+    def __init__(self):
+        self.queries = []
+        self.rows = []
+
+    def execute(self, sxql_query):
+        self.queries.append(sxql_query)
+        if sxql_query == 'SHOW META':
+            self.rows = [
+                {'Variable_name': 'total_found', 'Value': '1542'},
+                {'Variable_name': 'time', 'Value': '0.010'},
+            ]
+        else:
+            self.rows = [{'id': 1}]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def nextset(self):
+        self.rows = [{'facet_id': len(self.queries)}]
+        return True
+
+
+class FakeClient(object):
+    # MySQLdb-like module, searchd is down while is_down is True
+    # and the connection is lost on the "lost" query.
+
+    class OperationalError(Exception):
+        pass
+
+    class cursors(object):
+        DictCursor = None
+
+    def __init__(self, connect_time=0):
+        self.is_down = False
+        self.connect_time = connect_time
+        self.connections = []
+
+    def connect(self, **kwargs):
+        time.sleep(self.connect_time)
+        if self.is_down:
+            raise self.OperationalError(2003, "Can't connect to searchd")
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+
+class ConnectionCursor(FakeCursor):
+
+    def execute(self, sxql_query):
+        if sxql_query == 'lost':
+            raise FakeClient.OperationalError(2013, 'Lost connection to searchd')
+        if sxql_query == 'slow':
+            time.sleep(0.05)
+        super(ConnectionCursor, self).execute(sxql_query)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.is_closed = False
+
+    def cursor(self):
+        return ConnectionCursor()
+
+    def close(self):
+        self.is_closed = True
+
+
+class TestMetaCache(unittest.TestCase):
+
+    def get_connector(self, config):
+        connector = SphinxConnector(config)
+        connector.oursql, connector.mysqldb = False, True
+        return connector
+
+    def test_cached_meta(self):
+        connector = self.get_connector(MetaCacheConfig)
+        cursor = FakeCursor()
+        query = "SELECT * FROM company WHERE MATCH('Yandex') LIMIT %s,20 OPTION ranker=bm25"
+        first_page = connector._execute_batch(cursor, [(query % 0, 'result')])
+        second_page = connector._execute_batch(cursor, [(query % 20, 'result')])
+        self.assertEqual(cursor.queries.count('SHOW META'), 1)
+        self.assertEqual(second_page['result']['meta'], first_page['result']['meta'])
+        self.assertEqual(second_page['result']['meta']['total_found'], '1542')
+
+        second_page['result']['meta']['total_found'] = '0'
+        connector._execute_batch(cursor, [("SELECT * FROM company LIMIT 0,20", 'result')])
+        third_page = connector._execute_batch(cursor, [(query % 40, 'result')])
+        self.assertEqual(cursor.queries.count('SHOW META'), 2)
+        self.assertEqual(third_page['result']['meta']['total_found'], '1542')
+
+    def test_facet_limits(self):
+        connector = self.get_connector(MetaCacheConfig)
+        query = (
+            "SELECT * FROM company WHERE MATCH('\\' LIMIT 1,2') LIMIT %s,20 "
+            "OPTION ranker=bm25 FACET city_id LIMIT 0,%s"
+        )
+        self.assertEqual(
+            connector.get_meta_fingerprint(query % (20, 5)),
+            "SELECT * FROM company WHERE MATCH('\\' LIMIT 1,2') "
+            "OPTION ranker=bm25 FACET city_id LIMIT 0,5"
+        )
+        self.assertEqual(
+            connector.get_meta_fingerprint("SELECT * FROM company FACET city_id LIMIT 0,5"),
+            "SELECT * FROM company FACET city_id LIMIT 0,5"
+        )
+
+        cursor = FakeCursor()
+        for facet_limit in (5, 10):
+            connector._execute_batch(cursor, [(query % (0, facet_limit), 'result')])
+        self.assertEqual(cursor.queries.count('SHOW META'), 2)
+
+    def test_disabled(self):
+        connector = self.get_connector(BaseSearchConfig)
+        cursor = FakeCursor()
+        for offset in (0, 20):
+            connector._execute_batch(cursor, [(
+                'SELECT * FROM company LIMIT %s,20' % offset, 'result'
+            )], with_status=False)
+        self.assertEqual(cursor.queries.count('SHOW META'), 2)
+
+
+class TestFacets(unittest.TestCase):
+
+    def test_facets_result_sets(self):
+        connector = SphinxConnector(BaseSearchConfig)
+        connector.oursql, connector.mysqldb = False, True
+        cursor = FakeCursor()
+        result = connector._execute_batch(cursor, [
+            ('SELECT * FROM company FACET country_id FACET city_id', 'result',
+             ['country_id', 'city_id']),
+            ('SELECT * FROM product', 'products'),
+        ], with_meta=False, with_status=False)
+        self.assertEqual(result['result']['items'], [{'id': 1}])
+        self.assertEqual(list(result['result']['facets'].keys()), ['country_id', 'city_id'])
+        self.assertEqual(result['result']['facets']['city_id'], [{'facet_id': 1}])
+        self.assertFalse('facets' in result['products'])
+
+
+class ConnectionsConfig(BaseSearchConfig):
+    POOL_SIZE = 1
+
+
+class TestConnections(unittest.TestCase):
+
+    def get_connector(self):
+        connector = SphinxConnector(ConnectionsConfig)
+        connector.sql_client = FakeClient()
+        connector.oursql, connector.mysqldb = False, True
+        return connector
+
+    def test_unreachable_searchd(self):
+        connector = self.get_connector()
+        connector.sql_client.is_down = True
+        self.assertRaises(
+            SphinxQLConnectionException,
+            lambda: connector.execute('SELECT * FROM company')
+        )
+        connector.sql_client.is_down = False
+        self.assertEqual(connector.execute('SELECT * FROM company'), [{'id': 1}])
+
+    def test_lost_connection(self):
+        connector = self.get_connector()
+        connector.execute('SELECT * FROM company')
+        self.assertRaises(SphinxQLConnectionException, lambda: connector.execute('lost'))
+        self.assertEqual(len(connector.sql_client.connections), 1)
+        self.assertTrue(connector.sql_client.connections[0].is_closed)
+
+        self.assertEqual(connector.execute('SELECT * FROM company'), [{'id': 1}])
+        self.assertEqual(len(connector.sql_client.connections), 2)
+        self.assertFalse(connector.sql_client.connections[1].is_closed)
+
+    def test_shared_pool(self):
+        class PoolConfig(BaseSearchConfig):
+            POOL_SIZE = 4
+
+        connector = SphinxConnector(PoolConfig)
+        connector.sql_client = FakeClient(connect_time=0.01)
+        connector.oursql, connector.mysqldb = False, True
+        workers = [
+            threading.Thread(target=connector.execute, args=('slow',))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(connector.sql_client.connections), 4)
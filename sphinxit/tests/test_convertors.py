@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
 
+import re
 import random
+from array import array
 from datetime import datetime, date
 
 try:
@@ -11,13 +13,17 @@ except ImportError:
 from sphinxit.core.constants import RESERVED_KEYWORDS, ESCAPED_CHARS
 from sphinxit.core.exceptions import SphinxQLSyntaxException
 from sphinxit.core.helpers import (
+    QueryEscaper,
     list_of_integers_only,
     int_from_digit,
     sparse_free_sequence,
     unix_timestamp
 )
 from sphinxit.core.convertors import (
+    _checked_identifiers,
+    parse_filter_key,
     FilterCtx,
+    ORFilterCtx,
     MatchQueryCtx,
     AliasFieldCtx,
     LimitCtx,
@@ -25,6 +31,7 @@ from sphinxit.core.convertors import (
     FieldCtx,
     OptionsCtx,
     UpdateSetCtx,
+    InsertValueCtx,
 )
 
 
@@ -36,6 +43,11 @@ class ProductionConfig(object):
     DEBUG = False
 
 
+class TrustedConfig(object):
+    DEBUG = True
+    TRUSTED_IDENTIFIERS = True
+
+
 class TestListOfIntegersOnlyConverter(unittest.TestCase):
 
     def test_clean_sequence(self):
@@ -57,6 +69,11 @@ class TestListOfIntegersOnlyConverter(unittest.TestCase):
             lambda: list_of_integers_only(sequence, is_strict=True),
         )
 
+    def test_array_sequence(self):
+        self.assertListEqual(list_of_integers_only(array('I', [1, 2, 3])), [1, 2, 3])
+        self.assertListEqual(list_of_integers_only(range(1, 4)), [1, 2, 3])
+        self.assertListEqual(list_of_integers_only((1, 2, 3)), [1, 2, 3])
+
 
 class TestIntFromDigit(unittest.TestCase):
 
@@ -311,6 +328,20 @@ class TestFilterCtx(unittest.TestCase):
         with FilterCtxStrict('age__eq', 5.5) as value:
             self.assertEqual(value, 'age=5.5')
 
+    def test_condition_parsing(self):
+        with FilterCtxStrict('user__age__gte', 18) as value:
+            self.assertEqual(value, 'user__age>=18')
+
+        with FilterCtxSoft('age', 18) as value:
+            self.assertIsNone(value)
+
+        self.assertEqual(parse_filter_key('age__in'), ('age', 'in'))
+        self.assertEqual(parse_filter_key('age'), ('age', None))
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: ORFilterCtx('age__in', [1, 2]).with_config(DebugConfig).__enter__()
+        )
+
 
 MatchQueryCtxSoft = lambda *args, **kwargs: MatchQueryCtx(*args, **kwargs).with_config(ProductionConfig)
 MatchQueryCtxStrict = lambda *args, **kwargs: MatchQueryCtx(*args, **kwargs).with_config(DebugConfig)
@@ -368,6 +399,39 @@ class TestMatchQueryCtx(unittest.TestCase):
         with MatchQueryCtxSoft('   ') as value:
             self.assertIsNone(value)
 
+    def test_double_less_than_escape(self):
+        with MatchQueryCtxSoft('a << b <<< c < d') as value:
+            self.assertEqual(value, r'a \\<< b \\<<< c < d')
+
+    def test_escape_fuzz(self):
+        def two_pass_escape(query):
+            query = re.sub(
+                '|\\'.join(ESCAPED_CHARS.single_escape),
+                lambda m: r'\%s' % m.group(),
+                query
+            )
+            return re.sub(
+                '|\\'.join(ESCAPED_CHARS.double_escape),
+                lambda m: r'\\%s' % m.group(),
+                query
+            )
+
+        rnd = random.Random(42)
+        alphabet = (
+            list(ESCAPED_CHARS.single_escape)
+            + list(ESCAPED_CHARS.double_escape)
+            + ['<', '\\', ' ', 'a', 'Z', '1', '\u0436', '\u00e9']
+        )
+        escaper = QueryEscaper()
+        cached_escaper = QueryEscaper(cache_size=8)
+        for _ in range(2000):
+            query = ''.join(
+                rnd.choice(alphabet) for _ in range(rnd.randint(1, 30))
+            )
+            self.assertEqual(escaper.escape(query), two_pass_escape(query))
+            self.assertEqual(cached_escaper.escape(query), two_pass_escape(query))
+        self.assertTrue(len(cached_escaper._cache) <= 8)
+
     def test_invalid_query_strict(self):
         self.assertRaises(
             SphinxQLSyntaxException,
@@ -469,6 +533,40 @@ class TestFieldCtx(unittest.TestCase):
             lambda: FieldCtxStrict(random.choice(RESERVED_KEYWORDS)).__enter__()
         )
 
+    def test_trusted_attrs(self):
+        keyword = random.choice(RESERVED_KEYWORDS)
+        with FieldCtx(keyword).trusted().with_config(DebugConfig) as lex:
+            self.assertEqual(lex, keyword)
+
+        with FieldCtx(keyword).with_config(TrustedConfig) as lex:
+            self.assertEqual(lex, keyword)
+
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: FieldCtx(keyword).trusted(False).with_config(TrustedConfig).__enter__()
+        )
+
+    def test_checked_attrs(self):
+        with FieldCtxStrict('checked_name') as lex:
+            self.assertEqual(lex, 'checked_name')
+        self.assertIn('checked_name', _checked_identifiers)
+
+        with OrderCtxStrict('checked_name', 'desc') as lex:
+            self.assertEqual(lex, 'checked_name DESC')
+
+        keyword = random.choice(RESERVED_KEYWORDS)
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: FieldCtxStrict(keyword).__enter__()
+        )
+        self.assertNotIn(keyword, _checked_identifiers)
+
+        expression = "SNIPPET(content, 'private query')"
+        with AliasFieldCtxStrict(expression, 'snippet') as lex:
+            self.assertEqual(lex, "%s AS snippet" % expression)
+        self.assertIn('snippet', _checked_identifiers)
+        self.assertNotIn(expression, _checked_identifiers)
+
 
 LimitCtxSoft = lambda x, y: LimitCtx(x, y).with_config(ProductionConfig)
 LimitCtxStrict = lambda x, y: LimitCtx(x, y).with_config(DebugConfig)
@@ -898,3 +996,41 @@ class TestUpdateSetCtx(unittest.TestCase):
 
         with UpdateSetCtxSoft('attr', ['1', 2, None, 'string']) as lex:
             self.assertEqual(lex, 'attr=(1,2)')
+
+
+InsertValueCtxSoft = lambda x: InsertValueCtx(x).with_config(ProductionConfig)
+InsertValueCtxStrict = lambda x: InsertValueCtx(x).with_config(DebugConfig)
+
+class TestInsertValueCtx(unittest.TestCase):
+
+    def test_valid_attrs(self):
+        with InsertValueCtxStrict(42) as value:
+            self.assertEqual(value, '42')
+
+        with InsertValueCtxStrict(4.5) as value:
+            self.assertEqual(value, '4.5')
+
+        with InsertValueCtxStrict(True) as value:
+            self.assertEqual(value, '1')
+
+        with InsertValueCtxStrict("l'amour \\o/") as value:
+            self.assertEqual(value, "'l\\'amour \\\\o/'")
+
+        with InsertValueCtxStrict([1, '2', 3]) as value:
+            self.assertEqual(value, '(1,2,3)')
+
+        with InsertValueCtxStrict(date(2013, 7, 18)) as value:
+            self.assertEqual(value, unix_timestamp(date(2013, 7, 18)))
+
+    def test_invalid_attrs(self):
+        with InsertValueCtxSoft(None) as value:
+            self.assertIsNone(value)
+
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: InsertValueCtxStrict(None).__enter__()
+        )
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: InsertValueCtxStrict({'a': 1}).__enter__()
+        )
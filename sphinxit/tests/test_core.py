@@ -238,7 +238,7 @@ class TestSnippetsQueryNode(unittest.TestCase):
         )
         self.assertEqual(
             node.lex(),
-            "('me amore', 'me amore python'), 'index_name', 'me amore python'"
+            "('me amore', 'me amore python', 'me amore python'), 'index_name', 'me amore python'"
         )
 
     def test_incomplete_attrs(self):
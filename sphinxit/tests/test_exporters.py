@@ -0,0 +1,118 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sphinxit.core.exceptions import ImproperlyConfigured
+from sphinxit.core.exporters import RangeExporter
+from sphinxit.core.helpers import BaseSearchConfig
+from sphinxit.core.processor import Search
+
+
+class ExportConfig(BaseSearchConfig):
+    WITH_STATUS = False
+
+
+class RangesConnector(object):
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def execute(self, query_batch):
+        lex, alias = query_batch[0]
+        with self.lock:
+            self.queries.append(lex)
+        if 'MIN(id)' in lex:
+            return {alias: {'items': [{
+                'min_id': min(self.ids) if self.ids else None,
+                'max_id': max(self.ids) if self.ids else None,
+            }]}}
+
+        start, end = [int(v) for v in re.search(r'id BETWEEN (\d+) AND (\d+)', lex).groups()]
+        last_id = re.search(r'id>(\d+)', lex)
+        limit = int(re.search(r'LIMIT 0,(\d+)', lex).group(1))
+        ids = [
+            i for i in self.ids
+            if start <= i <= end and (not last_id or i > int(last_id.group(1)))
+        ]
+        return {alias: {'items': [
+            {'id': i, 'name': 'Company "%s"' % i} for i in ids[:limit]
+        ]}}
+
+
+class TestRangeExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path_template = os.path.join(self.tmp_dir, 'company-{partition}')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_ranges(self):
+        connector = RangesConnector(list(range(10, 101)))
+        search = Search(['company'], config=ExportConfig, connector=connector)
+        exporter = RangeExporter(search, partitions_count=4)
+        self.assertEqual(
+            exporter.get_ranges(),
+            [(10, 32), (33, 55), (56, 78), (79, 100)]
+        )
+        self.assertEqual(
+            connector.queries[0],
+            'SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM company LIMIT 0,1'
+        )
+        self.assertEqual(RangeExporter(search, partitions_count=200).get_ranges()[-1], (100, 100))
+        self.assertEqual(
+            RangeExporter(search.named('companies'), partitions_count=1).get_ranges(),
+            [(10, 100)]
+        )
+        self.assertEqual(RangeExporter(Search(
+            ['company'], config=ExportConfig, connector=RangesConnector([]),
+        )).get_ranges(), [])
+
+    def test_export_jsonl(self):
+        connector = RangesConnector(list(range(1, 101)))
+        search = Search(['company'], config=ExportConfig, connector=connector)
+        progress = []
+        exporter = RangeExporter(search, partitions_count=3, batch_size=10, progress=progress.append)
+        partitions = exporter.export(self.path_template + '.jsonl')
+        self.assertEqual([p['rows_written'] for p in partitions], [34, 34, 32])
+
+        exported_ids = []
+        for partition in partitions:
+            with io.open(partition['path'], encoding='utf-8') as export_file:
+                exported_ids.extend([json.loads(line)['id'] for line in export_file])
+        self.assertEqual(sorted(exported_ids), list(range(1, 101)))
+        self.assertEqual(len([p for p in progress if p['finished_at'] is not None]), 3)
+        self.assertEqual(len(progress), 4 * 3)
+
+    def test_export_csv(self):
+        connector = RangesConnector(list(range(1, 21)))
+        search = Search(['company'], config=ExportConfig, connector=connector)
+        partitions = RangeExporter(search, partitions_count=2).export(
+            self.path_template + '.csv', format='csv'
+        )
+        with io.open(partitions[0]['path'], encoding='utf-8', newline='') as export_file:
+            rows = list(csv.reader(export_file))
+        self.assertEqual(rows[0], ['id', 'name'])
+        self.assertEqual(rows[1], ['1', 'Company "1"'])
+        self.assertEqual(len(rows), 11)
+
+        self.assertRaises(
+            ImproperlyConfigured,
+            lambda: RangeExporter(search).export(self.path_template, format='xml')
+        )
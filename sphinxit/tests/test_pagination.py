@@ -0,0 +1,80 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import re
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sphinxit.core.helpers import BaseSearchConfig
+from sphinxit.core.pagination import PageCache, Paginator
+from sphinxit.core.processor import Search
+
+
+class PagesConfig(BaseSearchConfig):
+    WITH_STATUS = False
+
+
+class PagesConnector(object):
+
+    def __init__(self, total):
+        self.total = total
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def execute(self, query_batch):
+        lex, alias = query_batch[0]
+        with self.lock:
+            self.queries.append(lex)
+        offset, limit = [int(v) for v in re.search(r'LIMIT (\d+),(\d+)', lex).groups()]
+        return {alias: {'items': [
+            {'id': i} for i in range(offset + 1, min(offset + limit, self.total) + 1)
+        ]}}
+
+
+class TestPaginator(unittest.TestCase):
+
+    def test_prefetch(self):
+        connector = PagesConnector(total=25)
+        search = Search(['company'], config=PagesConfig, connector=connector).limit(0, 5)
+        paginator = Paginator(search, per_page=10)
+        self.assertEqual([item['id'] for item in paginator.page(1)['items']], list(range(1, 11)))
+        self.assertEqual([item['id'] for item in paginator.page(2)['items']], list(range(11, 21)))
+        self.assertEqual([item['id'] for item in paginator.page(3)['items']], list(range(21, 26)))
+        self.assertEqual(paginator.misses, 1)
+        self.assertEqual(paginator.hits, 2)
+        self.assertEqual(
+            sorted(connector.queries),
+            [
+                'SELECT * FROM company LIMIT 0,10',
+                'SELECT * FROM company LIMIT 10,10',
+                'SELECT * FROM company LIMIT 20,10',
+            ]
+        )
+        paginator.page(1)
+        self.assertEqual(len(connector.queries), 3)
+
+    def test_shared_cache(self):
+        connector = PagesConnector(total=100)
+        search = Search(['company'], config=PagesConfig, connector=connector)
+        cache = PageCache(max_size=2)
+        Paginator(search, per_page=10, prefetch=False, cache=cache).page(1)
+        paginator = Paginator(search, per_page=10, prefetch=False, cache=cache)
+        paginator.page(1)
+        self.assertEqual((paginator.hits, paginator.misses), (1, 0))
+        paginator.page(2)
+        paginator.page(3)
+        self.assertEqual(len(cache), 2)
+        paginator.page(1)
+        self.assertEqual(len(connector.queries), 4)
+
+    def test_cache_ttl(self):
+        cache = PageCache(ttl=0.01)
+        cache.set('page', {'items': []})
+        self.assertEqual(cache.get('page'), {'items': []})
+        time.sleep(0.02)
+        self.assertEqual(cache.get('page'), None)
@@ -1,21 +1,43 @@
 # coding=utf-8
 from __future__ import unicode_literals
 import datetime
+import re
+import threading
+from array import array
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
 
 try:
     import unittest2 as unittest
 except ImportError:
     import unittest
 
-from sphinxit.core.nodes import Count, OR, RawAttr
+from sphinxit.core.nodes import Bucket, Count, Interval, OR, RawAttr, SnippetAttr
 from sphinxit.core.processor import Search, Snippet
-from sphinxit.core.helpers import unix_timestamp, BaseSearchConfig
+from sphinxit.core.helpers import unix_timestamp, BaseSearchConfig, LRUCache
+from sphinxit.core.exceptions import SphinxQLChainException, SphinxQLSyntaxException
 
 
 class SearchConfig(BaseSearchConfig):
     WITH_STATUS = False
 
 
+class WritesConnector(object):
+
+    def __init__(self):
+        self.batches = []
+
+    def execute_writes(self, queries, transaction=False):
+        # Every document of the id IN filter is affected
+        self.batches.append(queries)
+        return sum([
+            len(q.split(' IN (')[1].split(')')[0].split(',')) for q in queries
+        ])
+
+
 class TestSearch(unittest.TestCase):
 
     def test_simple(self):
@@ -39,6 +61,58 @@ class TestSearch(unittest.TestCase):
             "SELECT * FROM company WHERE MATCH('Yandex')"
         )
 
+    def test_structural_sharing(self):
+        base = Search(indexes=['company'], config=SearchConfig).match('Yandex')
+        first = base.filter(id__gte=100).limit(0, 10)
+        second = base.filter(id__lt=10)
+        ordered = first.order_by('id', 'asc')
+        self.assertIs(first._nodes._nodes['Where'], ordered._nodes._nodes['Where'])
+        self.assertIsNot(first._nodes._nodes['OrderBy'], ordered._nodes._nodes['OrderBy'])
+        self.assertIsNot(base._nodes._nodes['Where'], first._nodes._nodes['Where'])
+        self.assertEqual(
+            base.lex(),
+            "SELECT * FROM company WHERE MATCH('Yandex')"
+        )
+        self.assertEqual(
+            first.lex(),
+            "SELECT * FROM company WHERE MATCH('Yandex') AND id>=100 LIMIT 0,10"
+        )
+        self.assertEqual(
+            second.lex(),
+            "SELECT * FROM company WHERE MATCH('Yandex') AND id<10"
+        )
+
+    def test_cached_lex(self):
+        base = Search(indexes=['company'], config=SearchConfig).match('Yandex')
+        sxql = base.lex()
+        self.assertIs(base.lex(), sxql)
+        where = base._nodes._nodes['Where']
+        self.assertFalse(hasattr(where, '_lex_cache'))
+
+        filtered = base.filter(id__gte=100)
+        self.assertEqual(
+            filtered.lex(),
+            "SELECT * FROM company WHERE MATCH('Yandex') AND id>=100"
+        )
+        self.assertEqual(where.lex(), "WHERE MATCH('Yandex')")
+        self.assertIs(base.lex(), sxql)
+
+        where.add_condition('id__lt', 10)
+        self.assertEqual(where.lex(), "WHERE MATCH('Yandex') AND id<10")
+
+    def test_compact_nodes(self):
+        search = (
+            Search(indexes=['company'], config=SearchConfig)
+            .match('Yandex')
+            .filter(id__gte=100)
+            .limit(0, 10)
+        )
+        search.lex()
+        self.assertFalse(hasattr(search, '__dict__'))
+        self.assertFalse(hasattr(search._nodes, '__dict__'))
+        for node in search._nodes._nodes.values():
+            self.assertFalse(hasattr(node, '__dict__'))
+
     def test_with_select(self):
         search = Search(indexes=['company'], config=SearchConfig)
         search = search.select('id', 'date_created')
@@ -157,6 +231,469 @@ class TestSearch(unittest.TestCase):
             "SELECT * FROM company, company_delta WHERE id>=100"
         )
 
+    def test_array_in_filter(self):
+        search = Search(['company'], config=SearchConfig)
+        self.assertEqual(
+            search.filter(id__in=array('l', [1, 2, 3])).lex(),
+            "SELECT * FROM company WHERE id IN (1,2,3)"
+        )
+        self.assertEqual(
+            search.filter(id__in=range(4, 7)).lex(),
+            "SELECT * FROM company WHERE id IN (4,5,6)"
+        )
+
+    def test_split_long_in_filter(self):
+        search = (
+            Search(['company'], config=SearchConfig)
+            .match('Yandex')
+            .filter(id__in=list(range(1000)) + [5, 7], rank__gt=1)
+            .order_by('rank', 'desc')
+            .limit(5, 10)
+        )
+        chunks = search.split(max_size=200)
+        self.assertTrue(len(chunks) > 1)
+        chunk_ids = []
+        for chunk in chunks:
+            self.assertTrue(len(chunk.lex()) <= 200)
+            self.assertIn("LIMIT 0,15", chunk.lex())
+            chunk_ids.extend(
+                chunk.lex().split(' IN (')[1].split(')')[0].split(',')
+            )
+        self.assertEqual(chunk_ids, [str(i) for i in range(1000)])
+        self.assertEqual(search.split(max_size=len(search.lex())), [search])
+
+        utf8_search = search.match('Яндекс')
+        for chunk in utf8_search.split(max_size=200):
+            self.assertTrue(len(chunk.lex().encode('utf-8')) <= 200)
+
+        self.assertRaises(
+            SphinxQLChainException,
+            lambda: search.group_by('rank').split(max_size=200),
+        )
+        self.assertRaises(
+            SphinxQLChainException,
+            lambda: Search(['company'], config=SearchConfig).match('Yandex').split(max_size=10),
+        )
+
+    def test_ask_split_query(self):
+        class SplitConfig(SearchConfig):
+            MAX_QUERY_SIZE = 100
+
+        class ChunksConnector(object):
+            def execute(self, query_batch):
+                self.query_batch = query_batch
+                return dict([
+                    (alias, {
+                        'items': [
+                            {'id': int(i), 'rank': int(i) % 7}
+                            for i in lex.split(' IN (')[1].split(')')[0].split(',')
+                        ],
+                        'meta': {'total': '3', 'total_found': '3'},
+                    })
+                    for lex, alias in query_batch
+                ])
+
+        connector = ChunksConnector()
+        search = (
+            Search(['company'], config=SplitConfig, connector=connector)
+            .filter(id__in=range(100))
+            .order_by('rank', 'desc')
+            .limit(0, 5)
+        )
+        result = search.ask()
+        self.assertTrue(len(connector.query_batch) > 1)
+        self.assertEqual(list(result.keys()), ['result'])
+        self.assertEqual(
+            [item['rank'] for item in result['result']['items']],
+            [6] * 5
+        )
+        self.assertEqual(
+            result['result']['meta']['total_found'],
+            str(3 * len(connector.query_batch))
+        )
+
+    def test_split_merge_keys(self):
+        class WeightsConnector(object):
+            def execute(self, query_batch):
+                self.query_batch = query_batch
+                return dict([
+                    (alias, {
+                        'items': [
+                            {
+                                'id': int(i),
+                                'name': 'name_%s' % i,
+                                'merge_key_0': int(i) % 3,
+                            }
+                            for i in lex.split(' IN (')[1].split(')')[0].split(',')
+                        ],
+                        'meta': {'total': '3', 'total_found': '3'},
+                    })
+                    for lex, alias in query_batch
+                ])
+
+        class SplitConfig(SearchConfig):
+            MAX_QUERY_SIZE = 150
+
+        connector = WeightsConnector()
+        search = (
+            Search(['company'], config=SplitConfig, connector=connector)
+            .select('name')
+            .match('Yandex')
+            .filter(id__in=range(100))
+            .limit(0, 4)
+        )
+        result = search.ask()['result']
+        self.assertTrue(len(connector.query_batch) > 1)
+        for lex, alias in connector.query_batch:
+            self.assertTrue(lex.startswith(
+                "SELECT name, WEIGHT() AS merge_key_0, id FROM company "
+            ))
+        self.assertEqual(
+            result['items'],
+            [{'name': 'name_%s' % i} for i in (2, 5, 8, 11)]
+        )
+
+        chunks = (
+            search.select('*')
+            .order_by('weight()', 'desc', trusted=True)
+            .split()
+        )
+        self.assertTrue(chunks[0].lex().startswith(
+            "SELECT name, *, weight() AS merge_key_0 FROM company "
+        ))
+        self.assertEqual(
+            search.select(('WEIGHT()', 'w'), trusted=True)._get_merge_keys(),
+            [('w', True, None), ('id', False, 'id')]
+        )
+
+        self.assertRaises(
+            SphinxQLChainException,
+            lambda: (
+                Search(['company'], config=SplitConfig)
+                .filter(tags__in=range(100), id__in=[1, 2])
+                .split()
+            )
+        )
+
+    def test_scan(self):
+        class PagesConnector(object):
+            def __init__(self):
+                self.queries = []
+
+            def execute(self, query_batch):
+                lex, alias = query_batch[0]
+                self.queries.append(lex)
+                last_id = re.search(r'id>(\d+)', lex)
+                offset, limit = re.search(r'LIMIT (\d+),(\d+)', lex).groups()
+                ids = [
+                    i for i in range(1, 26)
+                    if not last_id or i > int(last_id.group(1))
+                ]
+                return {alias: {'items': [
+                    {'id': i} for i in ids[int(offset):int(offset) + int(limit)]
+                ]}}
+
+        connector = PagesConnector()
+        search = Search(['company'], config=SearchConfig, connector=connector)
+        items = search.match('Yandex').scan(batch_size=10)
+        self.assertEqual(connector.queries, [])
+        self.assertEqual([item['id'] for item in items], list(range(1, 26)))
+        self.assertEqual(
+            connector.queries,
+            [
+                "SELECT * FROM company WHERE MATCH('Yandex') ORDER BY id ASC LIMIT 0,10",
+                "SELECT * FROM company WHERE MATCH('Yandex') AND id>10 ORDER BY id ASC LIMIT 0,10",
+                "SELECT * FROM company WHERE MATCH('Yandex') AND id>20 ORDER BY id ASC LIMIT 0,10",
+            ]
+        )
+
+        connector.queries = []
+        self.assertEqual(len(list(search.limit(0, 5).scan(batch_size=5000))), 25)
+        self.assertEqual(
+            connector.queries,
+            ["SELECT * FROM company ORDER BY id ASC LIMIT 0,5000 OPTION max_matches=5000"]
+        )
+
+        connector.queries = []
+        self.assertEqual(len(list(search.named('companies').scan(batch_size=50))), 25)
+
+        connector.queries = []
+        self.assertEqual(len(list(search.options(max_matches=20).scan(batch_size=50))), 25)
+        self.assertEqual(len(connector.queries), 2)
+
+        connector.queries = []
+        self.assertEqual(list(search.select('name').scan(batch_size=10)), [{}] * 25)
+        self.assertEqual(
+            connector.queries[0],
+            "SELECT name, id FROM company ORDER BY id ASC LIMIT 0,10"
+        )
+
+        self.assertRaises(
+            SphinxQLChainException,
+            lambda: list(search.order_by('rank', 'desc').scan())
+        )
+
+    def test_count(self):
+        class MetaConnector(object):
+            def execute(self, query_batch, with_meta=None, with_status=None):
+                self.query_batch = query_batch
+                self.flags = (with_meta, with_status)
+                return {'count': {'items': [{'id': 1}], 'meta': {'total_found': '1542'}}}
+
+        connector = MetaConnector()
+        search = (
+            Search(['company'], config=SearchConfig, connector=connector)
+            .select('name', ('GEODIST(lat, lon, 0.1, 0.2)', 'dist'))
+            .match('Yandex')
+            .filter(dist__lt=1000)
+            .order_by('name', 'asc')
+            .limit(100, 20)
+        )
+        self.assertEqual(search.count(), 1542)
+        self.assertEqual(connector.flags, (True, False))
+        self.assertEqual(
+            connector.query_batch,
+            [("SELECT id, GEODIST(lat, lon, 0.1, 0.2) AS dist FROM company "
+              "WHERE MATCH('Yandex') AND dist<1000 LIMIT 0,1", 'count')]
+        )
+
+        search.count(approximate=True)
+        self.assertTrue(connector.query_batch[0][0].endswith('LIMIT 0,1 OPTION cutoff=10000'))
+        search.options(cutoff=500).count(approximate=True, cutoff=100)
+        self.assertTrue(connector.query_batch[0][0].endswith('LIMIT 0,1 OPTION cutoff=500'))
+        self.assertEqual(
+            search.lex(),
+            "SELECT name, GEODIST(lat, lon, 0.1, 0.2) AS dist FROM company "
+            "WHERE MATCH('Yandex') AND dist<1000 ORDER BY name ASC LIMIT 100,20"
+        )
+
+    def test_facets(self):
+        class BatchConnector(object):
+            def execute(self, query_batch):
+                self.query_batch = query_batch
+                return {}
+
+        connector = BatchConnector()
+        search = (
+            Search(['company'], config=SearchConfig, connector=connector)
+            .match('Yandex')
+            .limit(0, 10)
+            .facet('country_id')
+            .facet('city_id', order_by='COUNT(*)', limit=5)
+            .facet('city_id')
+        )
+        self.assertEqual(
+            search.lex(),
+            "SELECT * FROM company WHERE MATCH('Yandex') LIMIT 0,10 "
+            "FACET country_id FACET city_id ORDER BY COUNT(*) DESC LIMIT 0,5"
+        )
+        search.ask()
+        self.assertEqual(
+            connector.query_batch,
+            [(search.lex(), 'result', ['country_id', 'city_id'])]
+        )
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: search.facet('category_id', order_by='COUNT(*)', ordering='up')
+        )
+        self.assertRaises(
+            SphinxQLChainException,
+            lambda: search.filter(id__in=range(1000)).split(100)
+        )
+
+    def test_select_trusted(self):
+        search = Search(['company'], config=SearchConfig)
+        self.assertEqual(
+            search.select('order', ('group', 'grp'), trusted=True).lex(),
+            "SELECT order, group AS grp FROM company"
+        )
+        self.assertEqual(
+            search.select(group='grp', trusted=True).lex(),
+            "SELECT group AS grp FROM company"
+        )
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: search.select('order')
+        )
+
+    def test_group_per_group(self):
+        search = (
+            Search(['company'], config=SearchConfig)
+            .match('Yandex')
+            .group_by('category_id', per_group=3)
+            .within_group_order_by('rank', 'desc')
+        )
+        self.assertEqual(
+            search.lex(),
+            "SELECT * FROM company WHERE MATCH('Yandex') "
+            "GROUP 3 BY category_id WITHIN GROUP ORDER BY rank DESC"
+        )
+        groups = search.group_items([
+            {'id': 1, 'category_id': 5},
+            {'id': 2, 'category_id': 5},
+            {'id': 3, 'category_id': 2},
+        ])
+        self.assertEqual(list(groups.keys()), [5, 2])
+        self.assertEqual([item['id'] for item in groups[5]], [1, 2])
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: Search(['company'], config=SearchConfig).group_by('category_id', per_group=0)
+        )
+        self.assertRaises(
+            SphinxQLChainException,
+            lambda: Search(['company'], config=SearchConfig).group_items([])
+        )
+
+    def test_histogram(self):
+        class HistogramConnector(object):
+            def __init__(self, items):
+                self.items = items
+
+            def execute(self, query_batch, with_meta=None, with_status=None):
+                self.query_batch = query_batch
+                return {'histogram': {'items': self.items}}
+
+        connector = HistogramConnector([
+            {'id': 1, 'price_interval': 0, 'bucket_count': 12},
+            {'id': 7, 'price_interval': 2, 'bucket_count': 3},
+        ])
+        search = (
+            Search(['company'], config=SearchConfig, connector=connector)
+            .match('Yandex')
+            .order_by('name', 'asc')
+            .limit(0, 20)
+        )
+        self.assertEqual(
+            search.histogram(Interval('price', [100, 500])),
+            [
+                {'bucket': 0, 'from': None, 'to': 100, 'count': 12},
+                {'bucket': 1, 'from': 100, 'to': 500, 'count': 0},
+                {'bucket': 2, 'from': 500, 'to': None, 'count': 3},
+            ]
+        )
+        self.assertEqual(
+            connector.query_batch[0][0],
+            "SELECT id, INTERVAL(price, 100, 500) AS price_interval, COUNT(*) AS bucket_count "
+            "FROM company WHERE MATCH('Yandex') GROUP BY price_interval LIMIT 0,3"
+        )
+
+        connector.items = [{'date_bucket': 16000, 'bucket_count': '5'}]
+        self.assertEqual(
+            search.histogram(Bucket('date', 86400)),
+            [{'bucket': 16000, 'from': 16000 * 86400, 'to': 16001 * 86400, 'count': 5}]
+        )
+        self.assertTrue(connector.query_batch[0][0].endswith('GROUP BY date_bucket LIMIT 0,1000'))
+
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: search.select(Interval('price', [10, 5]))
+        )
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: search.select(Bucket('price', 0))
+        )
+
+    def test_snippet_attr(self):
+        search = (
+            Search(['company'], config=SearchConfig)
+            .select('id', SnippetAttr(
+                'content', "It's amore",
+                before_match='<b>', limit=100, allow_empty=True,
+            ))
+            .match("It's amore")
+        )
+        self.assertEqual(
+            search.lex(),
+            "SELECT id, SNIPPET(content, 'It\\'s amore', 'allow_empty=1', "
+            "'before_match=<b>', 'limit=100') AS snippet "
+            "FROM company WHERE MATCH('It\\'s amore')"
+        )
+        self.assertEqual(
+            Search(['company'], config=SearchConfig)
+            .select(SnippetAttr('content', 'amore', alias='excerpt'))
+            .lex(),
+            "SELECT SNIPPET(content, 'amore') AS excerpt FROM company"
+        )
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: Search(['company'], config=SearchConfig).select(
+                SnippetAttr('content', 'amore', unknown_option=1)
+            )
+        )
+
+    def test_bulk_update(self):
+        connector = WritesConnector()
+        search = Search(['company'], config=SearchConfig, connector=connector)
+        values_by_id = OrderedDict([
+            (1, {'rank': 5}),
+            (2, {'rank': 7}),
+            (3, {'rank': 5}),
+            (4, {'rank': 5}),
+            (5, {'products': [1, 2]}),
+            (6, {'products': (1, 2)}),
+        ])
+        self.assertEqual(
+            list(search.bulk_update_queries(values_by_id, chunk_size=2)),
+            [
+                "UPDATE company SET rank=5 WHERE id IN (1,3)",
+                "UPDATE company SET rank=5 WHERE id IN (4)",
+                "UPDATE company SET rank=7 WHERE id IN (2)",
+                "UPDATE company SET products=(1,2) WHERE id IN (5,6)",
+            ]
+        )
+        self.assertEqual(
+            search.bulk_update(values_by_id, chunk_size=2, batch_size=3),
+            [4, 2]
+        )
+        self.assertEqual(len(connector.batches), 2)
+
+    def test_delete(self):
+        connector = WritesConnector()
+        search = Search(['rt_company'], config=SearchConfig, connector=connector)
+        search = search.filter(id__in=list(range(100, 120))).limit(0, 5)
+        queries = list(search.delete_queries(max_size=60))
+        self.assertEqual(
+            queries[0],
+            "DELETE FROM rt_company WHERE id IN (100,101,102,103,104,105)"
+        )
+        self.assertTrue(all([len(q) <= 60 for q in queries]))
+        self.assertEqual(len(queries), 4)
+        self.assertEqual(search.delete(max_size=60, batch_size=3), 20)
+        self.assertEqual([len(b) for b in connector.batches], [3, 1])
+        self.assertEqual(
+            list(search.filter(id__gte=110).delete_queries()),
+            ["DELETE FROM rt_company WHERE id IN (100,101,102,103,104,105,106,107,"
+             "108,109,110,111,112,113,114,115,116,117,118,119) AND id>=110"]
+        )
+        self.assertRaises(
+            SphinxQLChainException,
+            lambda: list(Search(['rt_company'], config=SearchConfig).delete_queries())
+        )
+        self.assertRaises(
+            SphinxQLChainException,
+            lambda: list(
+                Search(['rt_company', 'rt_product'], config=SearchConfig)
+                .filter(id__in=[1, 2])
+                .delete_queries()
+            )
+        )
+
+
+class SnippetsConnector(object):
+
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def execute(self, sxql_query):
+        with self.lock:
+            self.queries.append(sxql_query)
+        data = sxql_query.split("CALL SNIPPETS (")[1].rsplit(", 'company'", 1)[0]
+        return [
+            {'snippet': '<b>%s</b>' % d}
+            for d in re.findall(r"'((?:[^'\\]|\\.)*)'", data)
+        ]
+
 
 class TestSnippets(unittest.TestCase):
 
@@ -207,3 +744,77 @@ class TestSnippets(unittest.TestCase):
                 "'<strong>' AS before_match, '</strong>' AS after_match)"
             )
         )
+
+    def test_escaped_data(self):
+        snippets = (
+            Snippet(index='company', config=SearchConfig)
+            .for_query("amore")
+            .from_data("It's amore", "C:\\amore")
+        )
+        self.assertEqual(
+            snippets.lex(),
+            "CALL SNIPPETS (('It\\'s amore', 'C:\\\\amore'), 'company', 'amore')"
+        )
+
+    def test_batch(self):
+        connector = SnippetsConnector()
+        snippets = (
+            Snippet(index='company', config=SearchConfig, connector=connector)
+            .for_query('amore')
+            .options(before_match='<b>')
+        )
+        documents = ['amore %s' % (i % 3) for i in range(20)] + ["It's", '']
+        queries = snippets.batch_queries(documents, max_size=120)
+        self.assertTrue(len(queries) > 1)
+        self.assertTrue(all([len(q) <= 120 for q in queries]))
+        self.assertEqual(
+            queries[-1],
+            "CALL SNIPPETS (('It\\'s', ''), 'company', 'amore', '<b>' AS before_match)"
+        )
+
+        result = snippets.ask_batch(documents, max_size=120, workers_count=3)
+        self.assertEqual(len(connector.queries), len(queries))
+        self.assertEqual(
+            result,
+            ['<b>%s</b>' % d for d in documents[:20]] + ["<b>It\\'s</b>", '<b></b>']
+        )
+
+    def test_batch_cache(self):
+        connector = SnippetsConnector()
+        cache = LRUCache(max_size=100)
+        snippets = (
+            Snippet(index='company', config=SearchConfig, connector=connector, cache=cache)
+            .for_query('amore')
+            .options(before_match='<b>', after_match='</b>')
+        )
+        self.assertEqual(
+            snippets.ask_batch(['amore', 'mia', 'amore']),
+            ['<b>amore</b>', '<b>mia</b>', '<b>amore</b>']
+        )
+        # The options order follows the keyword arguments order,
+        # which is not kept before Python 3.7.
+        self.assertEqual(len(connector.queries), 1)
+        self.assertTrue(connector.queries[0].startswith(
+            "CALL SNIPPETS (('amore', 'mia'), 'company', 'amore', "
+        ))
+
+        same_snippets = (
+            Snippet(index='company', config=SearchConfig, connector=connector, cache=cache)
+            .for_query('amore')
+            .options(after_match='</b>', before_match='<b>')
+        )
+        self.assertEqual(
+            same_snippets.ask_batch(['mia', 'amore mia', 'amore']),
+            ['<b>mia</b>', '<b>amore mia</b>', '<b>amore</b>']
+        )
+        self.assertEqual(len(connector.queries), 2)
+        self.assertTrue(connector.queries[1].startswith(
+            "CALL SNIPPETS ('amore mia', 'company', 'amore', "
+        ))
+
+        other_query = (
+            Snippet(index='company', config=SearchConfig, connector=connector, cache=cache)
+            .for_query('mia')
+        )
+        other_query.ask_batch(['amore'])
+        self.assertEqual(len(connector.queries), 3)
@@ -0,0 +1,463 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+from sphinxit.core.exceptions import (
+    ImproperlyConfigured,
+    SphinxQLConnectionException,
+    SphinxQLDriverException,
+    SphinxQLSyntaxException,
+)
+from sphinxit.core.connector import SphinxConnector
+from sphinxit.core.helpers import BaseSearchConfig
+from sphinxit.core.writers import (
+    RTWriter,
+    RTPipeline,
+    ShardedRTWriter,
+    UpdateBuffer,
+    WriteAheadLog,
+)
+
+
+class WriterConfig(BaseSearchConfig):
+    WITH_STATUS = False
+
+
+class WritesConnector(object):
+
+    def __init__(self):
+        self.batches = []
+
+    def execute_writes(self, queries, transaction=False):
+        self.batches.append(queries)
+        return sum([q.count('), (') + 1 for q in queries])
+
+
+class TestRTWriter(unittest.TestCase):
+
+    def test_multi_row_statement(self):
+        connector = WritesConnector()
+        writer = RTWriter('rt_company', WriterConfig, connector=connector, replace=True)
+        writer.add({'id': 1, 'title': "It's mine", 'tags': [1, 2]})
+        writer.add({'title': 'Back\\slash', 'id': 2, 'tags': ()})
+        writer.add({'id': 3, 'price': 10.5})
+        self.assertEqual(
+            writer.lex(),
+            "REPLACE INTO rt_company (id, tags, title) VALUES "
+            "(1, (1,2), 'It\\'s mine'), (2, (), 'Back\\\\slash'); "
+            "REPLACE INTO rt_company (id, price) VALUES (3, 10.5)"
+        )
+        self.assertEqual(len(writer), 3)
+        self.assertEqual(writer.flush(), 3)
+        self.assertEqual(len(connector.batches), 1)
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(writer.rows_written, 3)
+        self.assertEqual(writer.flush(), 0)
+
+    def test_writes_order(self):
+        connector = WritesConnector()
+        writer = RTWriter('rt_company', WriterConfig, connector=connector, replace=True)
+        writer.add_rows([
+            {'id': 1, 'price': 10},
+            {'id': 1, 'title': 'new'},
+            {'id': 2, 'price': 20},
+        ])
+        self.assertEqual(
+            writer.get_statements()[0],
+            ["REPLACE INTO rt_company (id, price) VALUES (1, 10)",
+             "REPLACE INTO rt_company (id, title) VALUES (1, 'new')",
+             "REPLACE INTO rt_company (id, price) VALUES (2, 20)"]
+        )
+
+    def test_reserved_field(self):
+        connector = WritesConnector()
+        writer = RTWriter('rt_company', WriterConfig, connector=connector)
+        writer.add({'id': 1, 'title': 'a'})
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: writer.add({'id': 2, 'order': 'b'})
+        )
+        writer.add({'id': 3, 'title': 'c'})
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(
+            connector.batches,
+            [["INSERT INTO rt_company (id, title) VALUES (1, 'a'), (3, 'c')"]]
+        )
+
+        class LaxConfig(WriterConfig):
+            DEBUG = False
+
+        writer = RTWriter('rt_company', LaxConfig, connector=connector)
+        self.assertFalse(writer.buffer({'id': 2, 'order': 'b'}))
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.rows_written, 0)
+
+    def test_flush_by_rows(self):
+        connector = WritesConnector()
+        writer = RTWriter('rt_company', WriterConfig, connector=connector, max_rows=2)
+        writer.add_rows([{'id': i, 'price': i} for i in range(5)])
+        self.assertEqual(len(connector.batches), 2)
+        self.assertEqual(
+            connector.batches[0],
+            ["INSERT INTO rt_company (id, price) VALUES (0, 0), (1, 1)"]
+        )
+        with writer:
+            pass
+        self.assertEqual(len(connector.batches), 3)
+        self.assertEqual(writer.rows_written, 5)
+        self.assertEqual(writer.flushes_count, 3)
+        self.assertTrue(writer.rows_per_second >= 0)
+
+    def test_flush_by_bytes_and_time(self):
+        connector = WritesConnector()
+        writer = RTWriter(
+            'rt_company', WriterConfig, connector=connector,
+            max_rows=None, max_bytes=30, max_delay=None,
+        )
+        writer.add({'id': 1, 'title': 'short'})
+        self.assertEqual(len(connector.batches), 0)
+        writer.add({'id': 2, 'title': 'long enough to flush'})
+        self.assertEqual(len(connector.batches), 1)
+
+        writer = RTWriter('rt_company', WriterConfig, connector=connector, max_delay=0)
+        writer.add({'id': 1, 'title': 'now'})
+        self.assertEqual(len(connector.batches), 2)
+
+    def test_invalid_row(self):
+        writer = RTWriter('rt_company', WriterConfig, connector=WritesConnector())
+        self.assertRaises(
+            SphinxQLSyntaxException,
+            lambda: writer.add({'id': 1, 'title': None})
+        )
+
+    def test_failed_flush(self):
+        connector = FlakyConnector(failures=1)
+        writer = RTWriter('rt_company', WriterConfig, connector=connector)
+        writer.add_rows([{'id': 1}, {'id': 2}])
+        self.assertRaises(SphinxQLDriverException, writer.flush)
+        self.assertEqual(len(writer), 2)
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(len(writer), 0)
+
+
+class FlakyConnector(object):
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.transactions = []
+        self.lock = threading.Lock()
+
+    def execute_writes(self, queries, transaction=False):
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise SphinxQLConnectionException('searchd is gone away')
+            self.transactions.append((transaction, queries))
+        return len(queries)
+
+
+class TestRTPipeline(unittest.TestCase):
+
+    def test_run(self):
+        connector = FlakyConnector()
+        progress = []
+        pipeline = RTPipeline(
+            'rt_company', WriterConfig, connector=connector,
+            batch_rows=10, workers_count=3, queue_size=1,
+            progress=progress.append,
+        )
+        stats = pipeline.run({'id': i, 'price': i * 10} for i in range(95))
+        self.assertEqual(stats['rows_read'], 95)
+        self.assertEqual(stats['rows_written'], 95)
+        self.assertEqual(stats['batches_written'], 10)
+        self.assertEqual(len(progress), 10)
+        self.assertEqual(len(connector.transactions), 10)
+        self.assertTrue(all([t for t, _ in connector.transactions]))
+        written_ids = set()
+        for _, queries in connector.transactions:
+            for query in queries:
+                values = query.split(' VALUES ')[1]
+                written_ids.update([
+                    int(row.split(',')[0]) for row in values.strip('()').split('), (')
+                ])
+        self.assertEqual(written_ids, set(range(95)))
+
+    def test_retries(self):
+        connector = FlakyConnector(failures=2)
+        pipeline = RTPipeline(
+            'rt_company', WriterConfig, connector=connector,
+            batch_rows=10, workers_count=1, retries=2, retry_delay=0,
+        )
+        stats = pipeline.run({'id': i} for i in range(20))
+        self.assertEqual(stats['rows_written'], 20)
+        self.assertEqual(stats['retries'], 2)
+
+    def test_failed_batches(self):
+        connector = FlakyConnector(failures=3)
+        pipeline = RTPipeline(
+            'rt_company', WriterConfig, connector=connector,
+            batch_rows=10, workers_count=1, retries=1, retry_delay=0,
+        )
+        self.assertRaises(
+            SphinxQLDriverException,
+            lambda: pipeline.run({'id': i} for i in range(30))
+        )
+        self.assertEqual(pipeline.batches_failed, 1)
+        self.assertEqual(pipeline.rows_written, 20)
+
+
+class TestShardedRTWriter(unittest.TestCase):
+
+    def test_routing(self):
+        shards = [WritesConnector(), WritesConnector(), WritesConnector()]
+        writer = ShardedRTWriter('rt_company', WriterConfig, shards, max_rows=2)
+        writer.add_rows([{'id': i, 'price': i} for i in range(7)])
+        self.assertEqual(len(writer), 1)
+        with writer:
+            pass
+        self.assertEqual(writer.rows_written, 7)
+        self.assertEqual(
+            shards[0].batches,
+            [["INSERT INTO rt_company (id, price) VALUES (0, 0), (3, 3)"],
+             ["INSERT INTO rt_company (id, price) VALUES (6, 6)"]]
+        )
+        self.assertEqual(
+            shards[2].batches,
+            [["INSERT INTO rt_company (id, price) VALUES (2, 2), (5, 5)"]]
+        )
+        self.assertEqual([s['rows_written'] for s in writer.stats()], [3, 2, 2])
+
+    def test_hash_func(self):
+        shards = [WritesConnector(), WritesConnector()]
+        writer = ShardedRTWriter(
+            'rt_company', WriterConfig, shards, hash_func=lambda doc_id: doc_id // 10,
+        )
+        writer.add_rows([{'id': i} for i in (1, 5, 12)])
+        writer.flush()
+        self.assertEqual(shards[0].batches, [["INSERT INTO rt_company (id) VALUES (1), (5)"]])
+        self.assertEqual(shards[1].batches, [["INSERT INTO rt_company (id) VALUES (12)"]])
+
+    def test_failed_shard(self):
+        shards = [WritesConnector(), FlakyConnector(failures=1)]
+        writer = ShardedRTWriter('rt_company', WriterConfig, shards)
+        writer.add_rows([{'id': i} for i in range(4)])
+        self.assertRaises(SphinxQLDriverException, writer.flush)
+        self.assertEqual(writer.stats()[0]['rows_written'], 2)
+        self.assertEqual(writer.stats()[1]['rows_written'], 0)
+
+    def test_retry_failed_shard(self):
+        shards = [WritesConnector(), FlakyConnector(failures=1)]
+        writer = ShardedRTWriter('rt_company', WriterConfig, shards)
+        writer.add_rows([{'id': i} for i in range(4)])
+        self.assertRaises(SphinxQLDriverException, writer.flush)
+        self.assertEqual(len(writer), 2)
+
+        writer.add({'id': 5})
+        writer.flush()
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(
+            shards[1].transactions,
+            [(False, ["INSERT INTO rt_company (id) VALUES (1), (3)"]),
+             (False, ["INSERT INTO rt_company (id) VALUES (5)"])]
+        )
+
+    def test_shard_wals(self):
+        tmp_dir = tempfile.mkdtemp()
+        wals = [
+            WriteAheadLog(os.path.join(tmp_dir, 'rt_company_%s.wal' % i))
+            for i in range(2)
+        ]
+        try:
+            shards = [WritesConnector(), FlakyConnector(failures=1)]
+            writer = ShardedRTWriter('rt_company', WriterConfig, shards, wals=wals)
+            writer.add_rows([{'id': i} for i in range(4)])
+            writer.flush()
+            self.assertTrue(wals[0].is_empty())
+            self.assertFalse(wals[1].is_empty())
+            self.assertEqual(writer.replay(), 2)
+            self.assertEqual(
+                shards[1].transactions,
+                [(False, ["INSERT INTO rt_company (id) VALUES (1), (3)"])]
+            )
+        finally:
+            for wal in wals:
+                wal.close()
+            shutil.rmtree(tmp_dir)
+
+        self.assertRaises(
+            ImproperlyConfigured,
+            lambda: ShardedRTWriter('rt_company', WriterConfig, shards, wal=wals[0])
+        )
+        self.assertRaises(
+            ImproperlyConfigured,
+            lambda: ShardedRTWriter('rt_company', WriterConfig, shards, wals=wals[:1])
+        )
+
+
+class TestWriteAheadLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.wal = WriteAheadLog(os.path.join(self.tmp_dir, 'rt_company.wal'))
+
+    def tearDown(self):
+        self.wal.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_spill_and_replay(self):
+        connector = FlakyConnector(failures=1)
+        writer = RTWriter(
+            'rt_company', WriterConfig, connector=connector, max_rows=2, wal=self.wal,
+        )
+        writer.add_rows([{'id': i} for i in range(4)])
+        self.assertEqual(connector.transactions, [])
+        self.assertFalse(self.wal.is_empty())
+
+        self.assertEqual(writer.replay(max_rate=1000000), 4)
+        self.assertEqual(
+            [queries for _, queries in connector.transactions],
+            [["INSERT INTO rt_company (id) VALUES (0), (1)"],
+             ["INSERT INTO rt_company (id) VALUES (2), (3)"]]
+        )
+        self.assertTrue(self.wal.is_empty())
+        self.assertEqual(os.path.getsize(self.wal.path), 0)
+
+        writer.add_rows([{'id': 4}, {'id': 5}])
+        self.assertEqual(len(connector.transactions), 3)
+
+    def test_unreachable_searchd(self):
+        class DownClient(object):
+            class OperationalError(Exception):
+                pass
+
+            def connect(self, **kwargs):
+                raise self.OperationalError(2003, "Can't connect to searchd")
+
+        connector = SphinxConnector(WriterConfig)
+        connector.sql_client = DownClient()
+        connector.oursql, connector.mysqldb = True, False
+        writer = RTWriter('rt_company', WriterConfig, connector=connector, wal=self.wal)
+        writer.add_rows([{'id': 1}, {'id': 2}])
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(writer.replay(), 0)
+
+        writer.connector = WritesConnector()
+        self.assertEqual(writer.replay(), 2)
+        self.assertEqual(
+            writer.connector.batches,
+            [["INSERT INTO rt_company (id) VALUES (1), (2)"]]
+        )
+
+    def test_failed_replay(self):
+        connector = FlakyConnector(failures=2)
+        writer = RTWriter('rt_company', WriterConfig, connector=connector, wal=self.wal)
+        writer.add({'id': 1})
+        writer.flush()
+        writer.add({'id': 2})
+        writer.flush()
+        self.assertEqual(writer.replay(), 0)
+        self.assertEqual(writer.replay(), 2)
+        self.assertEqual(writer.rows_written, 2)
+
+    def test_rejected_batch(self):
+        class RejectingConnector(WritesConnector):
+            def execute_writes(self, queries, transaction=False):
+                if '(2)' in queries[0]:
+                    raise SphinxQLDriverException('duplicate id 2')
+                return super(RejectingConnector, self).execute_writes(queries, transaction)
+
+        connector = RejectingConnector()
+        writer = RTWriter('rt_company', WriterConfig, connector=connector, wal=self.wal)
+        writer.add({'id': 2})
+        self.assertRaises(SphinxQLDriverException, writer.flush)
+        self.assertTrue(self.wal.is_empty())
+
+        self.wal.append(['INSERT INTO rt_company (id) VALUES (2)'], 1)
+        self.wal.append(['INSERT INTO rt_company (id) VALUES (3)'], 1)
+        self.assertRaises(SphinxQLDriverException, writer.replay)
+        self.assertFalse(self.wal.is_empty())
+
+        rejected = []
+        self.assertEqual(
+            writer.replay(on_error=lambda *batch: rejected.append(batch[:2])),
+            1
+        )
+        self.assertEqual(rejected, [(['INSERT INTO rt_company (id) VALUES (2)'], 1)])
+        self.assertTrue(self.wal.is_empty())
+        self.assertFalse(os.path.exists(self.wal.offset_path + '.tmp'))
+
+    def test_incomplete_record(self):
+        self.wal.append(['INSERT INTO rt_company (id) VALUES (1)'], 1)
+        with open(self.wal.path, 'ab') as log:
+            log.write(b'\x00\x00\x01')
+        self.assertEqual(
+            [(statements, rows_count) for _, statements, rows_count in self.wal.records()],
+            [(['INSERT INTO rt_company (id) VALUES (1)'], 1)]
+        )
+
+
+class TestUpdateBuffer(unittest.TestCase):
+
+    def test_coalescing(self):
+        connector = WritesConnector()
+        updates = UpdateBuffer(WriterConfig, connector=connector, max_delay=None)
+        for hits in range(1, 11):
+            updates.update('company', 1, hits=hits)
+            updates.update('company', 2, hits=hits)
+        updates.update('company', 3, hits=10, rank=5)
+        updates.update('product', 1, hits=1)
+        self.assertEqual(len(updates), 4)
+        self.assertEqual(connector.batches, [])
+
+        with updates:
+            pass
+        self.assertEqual(len(updates), 0)
+        queries = sorted([q for batch in connector.batches for q in batch])
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(queries[0], "UPDATE company SET hits=10 WHERE id IN (1,2)")
+        self.assertEqual(queries[2], "UPDATE product SET hits=1 WHERE id IN (1)")
+        self.assertEqual(updates.values_received, 23)
+        self.assertEqual(updates.values_written, 5)
+        self.assertEqual(updates.coalescing_ratio, 23 / 5.0)
+        self.assertEqual(updates.flushes_count, 1)
+        self.assertTrue(updates.max_flush_latency >= updates.last_flush_latency >= 0)
+        self.assertEqual(updates.flush(), 0)
+
+    def test_failed_flush(self):
+        class FailingConnector(FlakyConnector):
+            def execute_writes(self, queries, transaction=False):
+                if self.failures:
+                    # The newer value comes while the flush is in progress
+                    updates.update('company', 1, hits=3)
+                return super(FailingConnector, self).execute_writes(queries, transaction)
+
+        connector = FailingConnector(failures=1)
+        updates = UpdateBuffer(WriterConfig, connector=connector, max_delay=None)
+        updates.update('company', 1, hits=2)
+        updates.update('company', 2, rank=5)
+        self.assertRaises(SphinxQLConnectionException, updates.flush)
+        self.assertEqual(len(updates), 2)
+
+        updates.flush()
+        self.assertEqual(
+            sorted([q for _, batch in connector.transactions for q in batch]),
+            ["UPDATE company SET hits=3 WHERE id IN (1)",
+             "UPDATE company SET rank=5 WHERE id IN (2)"]
+        )
+
+    def test_flush_by_time(self):
+        connector = WritesConnector()
+        updates = UpdateBuffer(WriterConfig, connector=connector, max_delay=0)
+        updates.update('company', 1, hits=1)
+        self.assertEqual(len(connector.batches), 1)